@@ -12,8 +12,8 @@ from skimage.io import imread
 import csv
 import numpy as np
 import matplotlib.pyplot as plt
-import copy
 import statistics
+import functools
 
 #lower the threthold for cluter fileter filterClusters(img, 3) 
 
@@ -46,9 +46,11 @@ def imgProcess(toBulkProcess):
     handlerFilter.setSKImages(filteredImageList)
     
 
-def writeTofile(array,csvFileName,toCSV):
+def writeTofile(array,csvFileName,toCSV,plots=None):#plots, when given, become the first column so the rows can be joined to labels.csv
     if toCSV == False:
         return
+    if plots != None:
+        array = [[plot]+list(row) for plot,row in zip(plots,array)]
     #filewriter = csv.writer(open(csvFileName, 'w'), delimiter=' ', lineterminator='\n')
     #filewriter.writerow(array)
     with open(csvFileName, 'w', newline ='') as csvFile:
@@ -56,6 +58,103 @@ def writeTofile(array,csvFileName,toCSV):
         writer.writerows(array)
     csvFile.close()
 
+def shardFileName(fileName,shard,shardCount):#one output file per shard, so shards can run side by side in the same folder
+    if shardCount == 1:
+        return fileName
+    root,ext = os.path.splitext(fileName)
+    return "%s_%d%s" % (root,shard,ext)
+
+def chunkPrefix(shard):
+    return "chunk_%03d_" % shard
+
+class FeatureWriter(object):#stream one record of features per plot into a folder of .npz chunks, so memory stays bounded by the chunk size
+    def __init__(self,folder,chunkSize=32,shard=0):
+        self.folder = folder
+        self.chunkSize = chunkSize
+        self.prefix = chunkPrefix(shard) #the chunks of each shard are numbered on their own
+        self.records = []
+        self.chunkCount = 0
+        os.makedirs(folder,exist_ok=True)
+        for f in os.listdir(folder):#start a fresh run of this shard, leaving the chunks of the other shards
+            if f.startswith(self.prefix) and f.endswith(".npz"):
+                os.remove(os.path.join(folder,f))
+    def write(self,plot,features):
+        self.records.append((str(plot),features))
+        if len(self.records) >= self.chunkSize:
+            self.flush()
+    def flush(self):
+        if len(self.records) == 0:
+            return
+        columns = {"Plot":np.array([plot for plot,_ in self.records])}
+        for name in self.records[0][1]:
+            values = [features[name] for _,features in self.records]
+            if np.ndim(values[0]) > 0:#a list per plot is stored flat with the offsets of each plot
+                columns[name+".values"] = np.array([x for v in values for x in v],dtype=float)
+                columns[name+".offsets"] = np.concatenate(([0],np.cumsum([len(v) for v in values])))
+            else:
+                columns[name] = np.array(values,dtype=float)
+        np.savez(os.path.join(self.folder,self.prefix+"%05d.npz" % self.chunkCount),**columns)
+        self.chunkCount += 1
+        self.records = []
+    def close(self):
+        self.flush()
+    def __enter__(self):
+        return self
+    def __exit__(self,*args):
+        self.close()
+
+def readFeatures(folder,shard=None):#load the chunks written by FeatureWriter into one DataFrame, list features come back as lists, all shards by default
+    prefix = "chunk_" if shard == None else chunkPrefix(shard)
+    frames = []
+    for f in sorted(os.listdir(folder)):
+        if not (f.startswith(prefix) and f.endswith(".npz")):
+            continue
+        with np.load(os.path.join(folder,f)) as chunk:
+            columns = {}
+            for key in chunk.files:
+                if key.endswith(".offsets"):
+                    name = key[:-len(".offsets")]
+                    values,offsets = chunk[name+".values"],chunk[key]
+                    columns[name] = [values[offsets[j]:offsets[j+1]].tolist() for j in range(len(offsets)-1)]
+                elif not key.endswith(".values"):
+                    columns[key] = chunk[key]
+            frames.append(pd.DataFrame(columns))
+    if len(frames) == 0:
+        return pd.DataFrame({"Plot":[]})
+    return pd.concat(frames,ignore_index=True)
+
+def featuresToCSV(folder,csvFileName,shard=None):#export the features to one csv file keyed by plot, list features spread over name_0, name_1, ...
+    features = readFeatures(folder,shard)
+    columns = []
+    for name in features.columns:
+        if len(features) > 0 and isinstance(features[name].iloc[0],list):
+            columns.append(pd.DataFrame(features[name].tolist(),index=features.index).add_prefix(name+"_"))
+        else:
+            columns.append(features[[name]])
+    pd.concat(columns,axis=1).to_csv(csvFileName,index=False)
+
+class LabelIndex(object):#labels.csv keyed by plot id, so images processed in any order, subset or shard still join their own labels
+    def __init__(self,fileName="labels.csv"):
+        labels = pd.read_csv(fileName,dtype={"Plot":str})
+        self.plots = labels["Plot"].tolist() #plots in file order
+        self.labels = {}
+        for plot,rowNum,percent,no in zip(self.plots,labels["rowNum"],labels["Percent"],labels["No"]):
+            self.labels[plot] = {"rowNum":int(rowNum),"Percent":percent,"No":int(no)}
+    def __len__(self):
+        return len(self.plots)
+    def __contains__(self,plot):
+        return str(plot) in self.labels
+    def __getitem__(self,plot):
+        return self.labels[str(plot)]
+    def getPlots(self,shard=0,shardCount=1):#every shardCount-th plot starting at shard, all plots by default
+        return self.plots[shard::shardCount]
+    def getRowNum(self,plot):
+        return self[plot]["rowNum"]
+    def getPercent(self,plot):
+        return self[plot]["Percent"]
+    def getImagePath(self,plot,folder="filtered_images"):#the images are named by the No column of the labels
+        return os.path.join(folder,"%03d.png" % self[plot]["No"])
+
 
 def strictFit(line,points,rowNum,width,drawable):
     
@@ -81,9 +180,33 @@ def verticalFit(line,points,rowNum,width,drawable):
     return [verticalFitModel[1],verticalFitModel[2]]
       
 
+def bestFit(line,points,rowNum,width,height):
+    #code from Anik
+    segments = []
+    totalMSE = 0
+    stripWidth = round(width / rowNum)
+    for j in range(rowNum):
+        
+        subPoints = line.getSubPoints(points, (stripWidth * (j + line.sideTrim)), (stripWidth * (j + 1 - line.sideTrim)))
+        
+        # Get the segment using the best fitting model AND the deviation/MSE
+        segment = line.getBestFit(subPoints, j * stripWidth, (j + 1) * stripWidth, height)
+        
+        # Append ONLY the line segment to the list of line segments
+        segments.append((segment[0], segment[1]))
+        
+        # Print current deviation/MSE of the line segment
+        # print(segment[2], " ", end='')
+        
+        # Update deviation/MSE
+        totalMSE += segment[2]
+            
+    # Print average deviation/MSE
+    return totalMSE / rowNum
+
 def densityFit(img,rows,drawable):
    
-    densityArr = pointsPerCol(copy.copy(img))
+    densityArr = pointsPerCol(img)
      #print(densityArr)
     peaks = findPeaks(rows,densityArr,9)
         
@@ -121,40 +244,42 @@ def drawImg3(points,interceptArr,drawable):    #based on vertical fitting
         plt.show()
         
 def pointsPerCol(img):
-    width = len(img[0])
-    lst = [0]*width
-    for i in range(len(img)):
-        for j in range(width):
-            if img[i][j]==255:
-                lst[j] += 1
-    return lst
+    return (np.asarray(img)==255).sum(axis=0).tolist() #number of dots in each column
                 
 def findPeaks(rows,arr,maskN):
     width = len(arr)
     peaks = []
     boarderMask = 5
-    for index in range(width):
-        if(index<=boarderMask or index >= width-boarderMask):
-            arr[index]=0
+    densities = np.array(arr)
+    densities[:boarderMask+1] = 0 #mask the columns at the boarders
+    densities[max(width-boarderMask,0):] = 0
     for row in range(rows):
-        maxIndex = 0
-        maxIndex = arr.index(max(arr))
+        maxIndex = int(np.argmax(densities)) #first column with the highest density
         peaks.append(maxIndex)
-        leftborder = (maxIndex-maskN)>0 and (maxIndex-maskN) or 0
-        rightborder = (maxIndex+maskN)>width and width or maxIndex+maskN
-        for i in range(leftborder,rightborder):
-            arr[i] = 0
+        densities[max(maxIndex-maskN,0):min(maxIndex+maskN,width)] = 0
+    if isinstance(arr,list):
+        arr[:] = densities.tolist()
     return peaks
 
 #convert the image to coordinates array
 #arr = []
 def coordinatesArray(image):
-    arr = []
-    for i in range(len(image)):
-        for j in range(len(image[0])):
-            if image[i][j]==255: #if there is a dot, save its coordinates               
-                arr.append((i,j))
-    return arr;
+    return driver.getPoints(image) #(N, 2) array of the coordinates of the dots
+
+#column and partition index of every dot in raster order, the partition index only moves on by one for each row of a column
+def findSegments(img,partitionLines):
+     height = len(img)
+     width = len(img[0])
+     targets = np.searchsorted(partitionLines,np.arange(width),side='left') #partition each column belongs to
+     starts = []
+     index = 0
+     for target in targets.tolist():
+         starts.append(index)
+         index = min(target,index+height)
+     starts = np.array(starts,dtype=np.int64)
+     pointRows,pointCols = np.nonzero(np.asarray(img)==255)
+     segIndex = np.where(pointRows<(targets-starts)[pointCols],starts[pointCols]+pointRows+1,targets[pointCols])
+     return pointCols,segIndex
 
 #Find MSE,Mean,sd for given lines
 def findMSE(img,lstOfLines,rows):
@@ -170,29 +295,15 @@ def findMSE(img,lstOfLines,rows):
          partitionLines.append(mid)
      
      partitionLines.append(width)
-     index = 0
-     totalSS = 0
-     totalPoints = 0
+     
+     # group the points on their partition index
+     pointCols,segIndex = findSegments(img,partitionLines)
+     dists = pointCols-np.asarray(lstOfLines)[segIndex]
+     totalSS = (dists**2).sum().item()
+     totalPoints = len(dists)
 
      # store distances from points to given lines in its partition to caculate dev and mean
-     distArrBySeg = [[] for i in range(rows)]
-     for col in range(width):
-         seg_ss = 0
-         
-         for row in range(height):
-             #print([row,col])
-             if (col<=partitionLines[index]):
-                 if (img[row][col]==255):
-                     totalPoints +=1
-                     seg_ss += (col-lstOfLines[index])**2
-                     distArrBySeg[index].append(abs(col-lstOfLines[index]))
-             else:
-                 index += 1;
-                 if (img[row][col]==255):
-                     totalPoints +=1
-                     seg_ss += (col-lstOfLines[index])**2
-                     distArrBySeg[index].append(abs(col-lstOfLines[index]))
-         totalSS += seg_ss
+     distArrBySeg = [np.abs(dists[segIndex==i]).tolist() for i in range(rows)]
      
      
      distDevArr = []
@@ -206,6 +317,57 @@ def findMSE(img,lstOfLines,rows):
      return [totalSS/totalPoints,totalMean,distDevArr,distMeanArr]      
                  
 
+def readImage(filename):
+    img = imread(filename)
+    if img.dtype == bool: #binary images are read as booleans by newer versions of sci-kit image
+        img = driver.toSKImg(img)
+    return img
+
+def allFits(sideTrim,labels,plot):#fit all four models on the image of one plot, reading each image and extracting the points only once
+    rowNum = labels.getRowNum(plot)
+    filtered = readImage(labels.getImagePath(plot,"filtered_images"))
+    processed = readImage(labels.getImagePath(plot,"processed_images"))
+    width = len(filtered[0])
+    height = len(filtered)
+    line = driver.Line(sideTrim)
+    points = driver.PointIndex(line.getPoints(filtered)) #shared by the strict, vertical and best fits
+    res = {"Plot":plot}
+    res["strict"] = strictFit(line,points,rowNum,width,False)
+    res["strict"][1].sort()
+    res["vertical"] = verticalFit(line,points,rowNum,width,False)
+    res["vertical"][1].sort()
+    res["density"] = densityFit(processed,rowNum,False)
+    res["density"][2].sort()
+    res["density"][3].sort()
+    res["best"] = [bestFit(line,points,rowNum,width,height)]
+    return res
+
+def allFitsToFeatures(plots,labels,sideTrim,workers,featureFolder,shard=0,shardCount=1):#stream the features of all four models into featureFolder as each image is done
+    with FeatureWriter(featureFolder,shard=shard) as writer:
+        for res in driver.imapImages(functools.partial(allFits,sideTrim,labels),plots,workers):
+            features = {}
+            for method in ("strict","vertical"):
+                features[method+"_MSE"] = res[method][0]
+                features[method+"_MSEArr"] = res[method][1]
+            features["density_MSE"],features["density_Mean"],features["density_DevArr"],features["density_MeanArr"] = res["density"][:4]
+            features["best_MSE"] = res["best"][0]
+            writer.write(res["Plot"],features)
+    featuresToCSV(featureFolder,shardFileName(featureFolder+".csv",shard,shardCount),shard if shardCount > 1 else None)
+
+def allFitsToCSV(plots,labels,sideTrim,workers,toCSV,shard=0,shardCount=1):#write the csv files of all four models in one run, in parallel across images
+    results = driver.mapImages(functools.partial(allFits,sideTrim,labels),plots,workers)
+    keys = [res["Plot"] for res in results] if shardCount > 1 else None #rows of a shard are keyed by plot
+    def write(array,csvFileName):
+        writeTofile(array,shardFileName(csvFileName,shard,shardCount),toCSV,keys)
+    for method in ("strict","vertical"):
+        write([res[method][1] for res in results],method+"_mse_arr.csv")
+        write([[res[method][0]] for res in results],method+"_totalMSE.csv")
+    write([res["density"][2] for res in results],"density_Deviation array.csv")
+    write([[res["density"][1]] for res in results],"density_totalMean.csv")
+    write([res["density"][3] for res in results],"density_Mean array.csv")
+    write([[res["density"][0]] for res in results],"density_totalMSE.csv")
+    write([res["best"] for res in results],"best_totalMSE.csv")
+
 def main2():
     
     toCSV = True #convert to csv
@@ -222,15 +384,21 @@ def main2():
     
     best = True
     
+    allMethods = False # all four models in one run, each csv file prefixed by its model
+    
+    workers = driver.WORKERS # number of worker processes for all four models
+    
+    featureFolder = None # stream one record per plot into this folder of .npz chunks (and folder.csv) instead of collecting the csv files in memory
+    
+    shard,shardCount = 0,1 # process only every shardCount-th plot starting at shard, each shard writes its own files keyed by plot
+    
     imgProcess(toBulkProcess)
     
     path,dirs,files = next(os.walk("raw_images"))
     # number of files in folder
     file_count = len(files)
-    #read labels file
-    readLabels= pd.read_csv('labels.csv')
-    #convert labels to list
-    rowNumList = readLabels["rowNum"].tolist()
+    #read labels file, keyed by plot
+    labels = LabelIndex('labels.csv')
     #no sideTrim
     sideTrim = 0
     
@@ -240,13 +408,26 @@ def main2():
     DevArr = []
     MeanArr = []
     n = file_count #can be set to a different value for iterating
+    plots = labels.getPlots()[:n][shard::shardCount]
+    
+    if (allMethods == True and featureFolder != None):
+        allFitsToFeatures(plots,labels,sideTrim,workers,featureFolder,shard,shardCount)
+        return
+    if (allMethods == True):
+        allFitsToCSV(plots,labels,sideTrim,workers,toCSV,shard,shardCount)
+        return
+    writer = None
+    if (featureFolder != None):
+        writer = FeatureWriter(featureFolder,shard=shard)
+    keys = [] # plots of the rows written to the csv files
        
-    for i in range(n):
+    for plot in plots:
+        rowNum = labels.getRowNum(plot)
         filename = ""
         if (vertical or strict or best):
-            filename = "filtered_images/%03d.png" % i
+            filename = labels.getImagePath(plot,"filtered_images")
         elif (density):
-            filename = "processed_images/%03d.png" % i
+            filename = labels.getImagePath(plot,"processed_images")
         
         img = None
               
@@ -255,7 +436,7 @@ def main2():
          # Open a single image
         try:
                     
-            img = imread(filename)
+            img = readImage(filename)
 
         except FileNotFoundError:
                     
@@ -268,62 +449,64 @@ def main2():
         res = []
         if (strict == True): 
             points = line.getPoints(img) 
-            res = strictFit(line,points,rowNumList[i],width,drawable)
-            if len(res)>0:
+            res = strictFit(line,points,rowNum,width,drawable)
+            if len(res)>0 and writer != None:
+                res[1].sort()
+                writer.write(plot,{"MSE":res[0],"MSEArr":res[1]})
+            elif len(res)>0:
                 res[1].sort()
                 MSEArr.append(res[1])
                 MSE.append([res[0]])                
+                keys.append(plot)
         elif (vertical == True):
             points = line.getPoints(img) 
-            res = verticalFit(line,points,rowNumList[i],width,drawable)
-            if len(res)>0:  
+            res = verticalFit(line,points,rowNum,width,drawable)
+            if len(res)>0 and writer != None:
+                res[1].sort()
+                writer.write(plot,{"MSE":res[0],"MSEArr":res[1]})
+            elif len(res)>0:  
                 res[1].sort()
                 MSEArr.append(res[1])
                 MSE.append([res[0]]) 
+                keys.append(plot)
         elif(density == True):
-            res = densityFit(img,rowNumList[i],drawable)
-            if len(res)>0:
+            res = densityFit(img,rowNum,drawable)
+            if len(res)>0 and writer != None:
+                res[2].sort()
+                res[3].sort()
+                writer.write(plot,{"MSE":res[0],"Mean":res[1],"DevArr":res[2],"MeanArr":res[3]})
+            elif len(res)>0:
                 res[2].sort()
                 res[3].sort()
                 MSE.append([res[0]]) 
                 Mean.append([res[1]])
                 DevArr.append(res[2]) # it is stand deviation
                 MeanArr.append(res[3])
+                keys.append(plot)
         elif(best == True):
-            #code from Anik
-            segments = []
-            totalMSE = 0
-            stripWidth = round(width / rowNumList[i])
-            points = line.getPoints(img)
-            for j in range(rowNumList[i]):
-                
-                subPoints = line.getSubPoints(points, (stripWidth * (j + sideTrim)), (stripWidth * (j + 1 - sideTrim)))
-                
-                # Get the segment using the best fitting model AND the deviation/MSE
-                segment = line.getBestFit(subPoints, j * stripWidth, (j + 1) * stripWidth, height)
-                
-                # Append ONLY the line segment to the list of line segments
-                segments.append((segment[0], segment[1]))
-                
-                # Print current deviation/MSE of the line segment
-                # print(segment[2], " ", end='')
-                
-                # Update deviation/MSE
-                totalMSE += segment[2]
-                    
-                    # Print average deviation/MSE
-                avgMSE = totalMSE / rowNumList[i]
-            MSE.append([avgMSE])
+            points = driver.PointIndex(line.getPoints(img))
+            if writer != None:
+                writer.write(plot,{"MSE":bestFit(line,points,rowNum,width,height)})
+            else:
+                MSE.append([bestFit(line,points,rowNum,width,height)])
+                keys.append(plot)
     #print(MSE)
     #print(MSEArr)    
 
+    if (writer != None):
+        writer.close()
+        featuresToCSV(featureFolder,shardFileName(featureFolder+".csv",shard,shardCount),shard if shardCount > 1 else None)
+        return
+
+    if (shardCount == 1):
+        keys = None # a single run keeps the positional csv files
     if(density == True):
-        writeTofile(DevArr,"Deviation array.csv",toCSV) 
-        writeTofile(Mean,"totalMean.csv",toCSV) 
-        writeTofile(MeanArr,"Mean array.csv",toCSV) 
+        writeTofile(DevArr,shardFileName("Deviation array.csv",shard,shardCount),toCSV,keys) 
+        writeTofile(Mean,shardFileName("totalMean.csv",shard,shardCount),toCSV,keys) 
+        writeTofile(MeanArr,shardFileName("Mean array.csv",shard,shardCount),toCSV,keys) 
     elif(vertical == True or strict == True):
-        writeTofile(MSEArr,"mse_arr.csv",toCSV)
-    writeTofile(MSE,"totalMSE.csv",toCSV) 
+        writeTofile(MSEArr,shardFileName("mse_arr.csv",shard,shardCount),toCSV,keys)
+    writeTofile(MSE,shardFileName("totalMSE.csv",shard,shardCount),toCSV,keys) 
 
 if __name__ == '__main__':   
     main2()
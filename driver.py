@@ -11,13 +11,20 @@ from os import listdir
 from os.path import isfile, join
 from PIL import Image, ImageEnhance
 from skimage.io import imread
+from skimage.measure import label
 from statistics import mean
-import colorsys, matplotlib.pyplot, numpy, os, pygame, shutil, statistics, sys
+import collections, colorsys, functools, matplotlib.pyplot, multiprocessing, numpy, os, pygame, shutil, statistics, sys
 
 INPUTFOLDERNAME = "raw_images"
 INTERMEDFOLDERNAME = "processed_images"
 OUTPUTFOLDERNAME = "filtered_images"
 MAXROWS = 20
+PYRAMIDFACTOR = 1
+PYRAMIDWINDOW = None
+PRUNEBESTFIT = False
+ROWSEARCH = "linear"
+MASKFORMATS = ("png", "npz")
+WORKERS = 1
 
 pygame.init()
 
@@ -32,13 +39,33 @@ if not os.path.isdir(logF):
     
     os.mkdir(logF)
     
-# Create log file with current timestamp
+# Name the log file with current timestamp, it is only created by the first output of the parent process
 logFileName = timestamp.strftime("%Y_%m_%d_%H_%M_%S")
-logFile = open(logF + "/" + logFileName + ".log", "w+")
+logFile = None
+
+# Candidate fit of the row count search running in a worker process
+rowCountFit = None
+
+# Barrier shared by the workers of a pool, so data handed to every worker reaches each of them exactly once
+workerBarrier = None
 
 
 def logOutput(outputs):
     
+    global logFile
+    
+    # Worker processes only display their output, opening the timestamped log again would truncate the log of the parent
+    if multiprocessing.parent_process() is not None:
+        
+        print(outputs)
+        
+        return
+    
+    # Create log file on first use
+    if logFile is None:
+        
+        logFile = open(logF + "/" + logFileName + ".log", "w+")
+    
     # # Write outputs to log file
     for output in outputs:
     
@@ -46,6 +73,9 @@ def logOutput(outputs):
     
     logFile.write("\n")
     
+    # Flush every output, so forked worker processes never inherit lines that are still buffered
+    logFile.flush()
+    
     # Display output in console
     print(outputs)
 
@@ -78,18 +108,78 @@ class Level(object):
         return tuple(int(255 * i)
                 for i
                 in colorsys.hsv_to_rgb(h, s, new_v))
-        
+
+    # Obtain the level values of all 256 possible values of the V channel
+    def getCurve(self):
+
+        return numpy.array([self.newLevel(i / 255.0) for i in range(256)])
+
+    # Level and convert a whole RGB array at once using the same HSV math as colorsys
+    def levelArray(self, rgb):
+
+        rgb = numpy.asarray(rgb)
+        r, g, b = (rgb[..., i] / 255.0 for i in range(3))
+
+        # Convert to HSV, the value channel is just the maximum band
+        maxc = numpy.maximum(numpy.maximum(r, g), b)
+        minc = numpy.minimum(numpy.minimum(r, g), b)
+        rangec = maxc - minc
+        grey = rangec == 0
+
+        # Avoid dividing by zero for grey pixels, their hue and saturation are zero anyway
+        safeMax = numpy.where(grey, 1.0, maxc)
+        safeRange = numpy.where(grey, 1.0, rangec)
+
+        s = numpy.where(grey, 0.0, rangec / safeMax)
+        rc = (maxc - r) / safeRange
+        gc = (maxc - g) / safeRange
+        bc = (maxc - b) / safeRange
+
+        h = numpy.where(r == maxc, bc - gc, numpy.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+        h = numpy.where(grey, 0.0, (h / 6.0) % 1.0)
+
+        # Look up the new level of the V channel from the precomputed curve
+        v = self.getCurve()[rgb[..., :3].max(axis=-1)]
+
+        # Convert back to RGB
+        i = (h * 6.0).astype(int)
+        f = (h * 6.0) - i
+        p = v * (1.0 - s)
+        q = v * (1.0 - s * f)
+        t = v * (1.0 - s * (1.0 - f))
+        i = i % 6
+
+        sector = [i == k for k in range(6)]
+        red = numpy.select(sector, [v, q, p, p, t, v])
+        green = numpy.select(sector, [t, v, v, q, p, p])
+        blue = numpy.select(sector, [p, p, t, v, v, q])
+
+        levelled = numpy.stack([red, green, blue], axis=-1)
+        levelled[grey] = v[grey][:, None]
+
+        return (255 * levelled).astype(numpy.uint8)
+
 
 # Class for handling image files
 class File(object):
     
     # Constructor
-    def __init__(self, inF, outF):
+    def __init__(self, inF, outF, workers=1, maskFormat="png"):
         
         # Initialize input and output directories
         self.inF = inF
         self.outF = outF
         
+        # Initialize number of worker processes used to read batches of images
+        self.workers = workers
+        
+        # Initialize format binary masks are saved in, either 1-bit PNG or bit-packed NumPy arrays
+        if maskFormat not in MASKFORMATS:
+            
+            raise ValueError("Unknown mask format")
+        
+        self.maskFormat = maskFormat
+        
         # Clear output directory to avoid storing images from past executions
         if os.path.isdir(self.outF):
             
@@ -125,29 +215,19 @@ class File(object):
             
         return [f for f in listdir(self.inF) if isfile(join(self.inF, f))]
     
-    # Returns a list of image objects from the input folder
-    def getImages(self):
+    # Returns a list of image objects from the input folder, read in the given pool of worker processes if any
+    def getImages(self, pool=None):
         
         fileNames = self.getFileNames()
-        imageList = []
-        
-        for file in fileNames:
-            
-            imageList.append(self.getImg(file))
         
-        return imageList
+        return mapImages(self.getLoadedImg, fileNames, self.workers, pool=pool)
 
-    # Returns a list of sci-kit image objects in the input folder
-    def getSKImages(self):
+    # Returns a list of sci-kit image objects in the input folder, read in the given pool of worker processes if any
+    def getSKImages(self, pool=None):
         
         filenames = self.getFileNames()
-        imageList = []
-        
-        for file in filenames:
-            
-            imageList.append(self.getSKImg(file))
         
-        return imageList
+        return mapImages(self.getSKImg, filenames, self.workers, pool=pool)
     
     # Saves a list of image objects as image in the output folder
     def setImages(self, imageList):
@@ -158,7 +238,7 @@ class File(object):
         
         for i, img in enumerate(imageList):
             
-            img.save(self.outF + "/{:03d}.png".format(i))
+            self.setImg(img, i)
     
     # Saves a list of sci-kit image objects as image in the output folder
     def setSKImages(self, imageList):
@@ -169,7 +249,57 @@ class File(object):
         
         for i, img in enumerate(imageList):
             
-            matplotlib.pyplot.imsave((self.outF + "/{:03d}.png".format(i)), img, cmap='gray')
+            self.setSKImg(img, i)
+    
+    # Returns a list of binary masks in the input folder, read in the given pool of worker processes if any
+    def getMasks(self, pool=None):
+        
+        fileNames = self.getFileNames()
+        
+        return mapImages(self.getMaskImg, fileNames, self.workers, pool=pool)
+    
+    # Saves a list of binary masks in the output folder
+    def setMasks(self, maskList):
+        
+        for i, mask in enumerate(maskList):
+            
+            self.setMask(mask, i)
+    
+    # Saves a single image object as the i-th image in the output folder
+    def setImg(self, img, i):
+        
+        os.makedirs(self.outF, exist_ok=True)
+        
+        img.save(self.outF + "/{:03d}.png".format(i))
+    
+    # Saves a single sci-kit image object as the i-th image in the output folder
+    def setSKImg(self, img, i):
+        
+        os.makedirs(self.outF, exist_ok=True)
+        
+        matplotlib.pyplot.imsave((self.outF + "/{:03d}.png".format(i)), img, cmap='gray')
+    
+    # Saves a single binary mask as the i-th mask in the output folder
+    def setMask(self, mask, i):
+        
+        os.makedirs(self.outF, exist_ok=True)
+        
+        writeMask(self.outF + "/{:03d}.{}".format(i, self.maskFormat), mask)
+    
+    # Returns a single binary mask
+    def getMaskImg(self, fileName):
+        
+        mask = None
+        
+        try:
+            
+            mask = readMask(self.inF + "/" + fileName)
+            
+        except FileNotFoundError:
+            
+            logOutput ("Invalid filename")
+        
+        return mask
     
     # Returns a single image object
     def getImg(self, fileName):
@@ -186,6 +316,17 @@ class File(object):
         
         return img
     
+    # Returns a single image object with its pixel data already decoded
+    def getLoadedImg(self, fileName):
+        
+        img = self.getImg(fileName)
+        
+        if img is not None:
+            
+            img.load()
+        
+        return img
+    
     # Returns a single sci-kit image object
     def getSKImg(self, fileName):
         
@@ -195,6 +336,11 @@ class File(object):
             
             img = imread(self.inF + "/" + fileName)
             
+            # Binary images are read as booleans by newer versions of sci-kit image
+            if img.dtype == bool:
+                
+                img = toSKImg(img)
+            
         except FileNotFoundError:
             
             logOutput ("Invalid filename")
@@ -226,83 +372,87 @@ class Trim(object):
     # Smart trimming that trims the top and the bottom of the image based on pixel density of each row 
     def smartTrim(self, img):
         
+        top, bottom = self.getTrimBounds(img)
+        
+        # Binary masks held as arrays are trimmed by slicing
+        if isinstance(img, numpy.ndarray):
+            
+            return img[top:bottom]
+        
         width = img.size[0]
         
         left = 0
         right = width
-        top = self.getTop(img)
-        bottom = self.getBottom(img)
         
         return img.crop((left, top, right, bottom))
     
-    # Compares each single pixel row of the image starting from the top with the threshold, and returns the distance from the top when the white pixel density falls below the threshold
-    def getTop(self, img):
-        
-        width, height = img.size
+    # Counts the white pixels in each single pixel row of the image
+    def getRowProfile(self, img):
         
-        left = 0
-        right = width
+        pixels = numpy.asarray(img)
         
-        for i in range (int(height / (2 * self.rowHeight)) - 1):
-            
-            rowImg = img.crop((left, i * self.rowHeight, right, (i + 1) * self.rowHeight))
-            pixels = rowImg.getdata()
+        # Binary images are read as booleans, everything else is compared with the white threshold
+        if pixels.dtype != bool:
             
             whiteThresh = 50
-            count = 0
-            
-            for pixel in pixels:
-                
-                if pixel > whiteThresh:
-                    
-                    count += 1
-                    
-            n = len(pixels)
-            
-            if (count / float(n)) < self.maxWhiteThresh:
-                
-                return ((i + 1) * self.rowHeight)
-            
-        return  (int(height / 2) - 1)
+            pixels = pixels > whiteThresh
+        
+        return pixels.sum(axis=1)
     
-    # Compares each single pixel row of the image starting from the bottom with the threshold, and returns the distance from the top when the white pixel density falls below the threshold
-    def getBottom(self, img):
+    # Scans the row profile from the top and from the bottom at once, and returns the distances from the top where the white pixel density of a strip of rows falls below the threshold
+    def getTrimBounds(self, img):
         
-        width, height = img.size
+        profile = self.getRowProfile(img)
         
-        left = 0
-        right = width
+        height = len(profile)
+        width = numpy.asarray(img).shape[1]
         
-        for i in range (int(height / (2 * self.rowHeight)) - 1):
-            
-            rowImg = img.crop((left, height - ((i + 1) * self.rowHeight), right, height - (i * self.rowHeight)))
-            pixels = rowImg.getdata()
-            
-            whiteThresh = 50
-            count = 0
-            
-            for pixel in pixels:
-                
-                if pixel > whiteThresh:
-                    
-                    count += 1
-                    
-            n = len(pixels)
-            
-            if (count / float(n)) < self.maxWhiteThresh:
-                
-                return (height - ((i + 1) * self.rowHeight))
-            
-        return  (int(height / 2) + 1)
+        # Prefix sums of the profile give the white pixel count of any strip of rows
+        prefix = numpy.concatenate(([0], numpy.cumsum(profile)))
+        edges = numpy.arange(int(height / (2 * self.rowHeight))) * self.rowHeight
+        
+        n = float(width * self.rowHeight)
+        topDensity = (prefix[edges[1:]] - prefix[edges[:-1]]) / n
+        bottomDensity = (prefix[height - edges[:-1]] - prefix[height - edges[1:]]) / n
+        
+        topStrips = numpy.flatnonzero(topDensity < self.maxWhiteThresh)
+        bottomStrips = numpy.flatnonzero(bottomDensity < self.maxWhiteThresh)
+        
+        top = (topStrips[0] + 1) * self.rowHeight if len(topStrips) else int(height / 2) - 1
+        bottom = height - ((bottomStrips[0] + 1) * self.rowHeight) if len(bottomStrips) else int(height / 2) + 1
+        
+        return int(top), int(bottom)
+    
+    # Compares each single pixel row of the image starting from the top with the threshold, and returns the distance from the top when the white pixel density falls below the threshold
+    def getTop(self, img):
+        
+        return self.getTrimBounds(img)[0]
+    
+    # Compares each single pixel row of the image starting from the bottom with the threshold, and returns the distance from the top when the white pixel density falls below the threshold
+    def getBottom(self, img):
+        
+        return self.getTrimBounds(img)[1]
 
 
 # Class for fitting lines in a cluster of points
 class Line(object):
     
     # Constructor
-    def __init__(self, sideTrim):
+    def __init__(self, sideTrim, pyramidFactor=1, pyramidWindow=None, verify=False, prune=False):
         
         self.sideTrim = sideTrim
+        
+        # Initialize the downsampling factor of the coarse search and the number of pixels around the coarse optimum searched at full resolution, a factor of 1 searches exhaustively
+        self.pyramidFactor = pyramidFactor
+        self.pyramidWindow = pyramidFactor if pyramidWindow is None else pyramidWindow
+        
+        # Initialize the verification of the coarse-to-fine searches against the exhaustive searches
+        self.verify = verify
+        self.searchCount = 0
+        self.mismatchCount = 0
+        
+        # Initialize whether best fit candidates are abandoned once their distance passes the best candidate so far
+        self.prune = prune
     
     # Returns the gradient and the intercept of a line equation
     def getLineEq(self, segment):
@@ -327,39 +477,159 @@ class Line(object):
     # Fits a line in a subset of points that reside between a starting value and an ending value of y
     def getBestFit(self, points, start, end, height):
         
-        # Initialize the minimum distance as infinity
-        minDist = [(-1, -1), (-1, -1), sys.maxsize, -1]
+        stripWidth = end - start
+        
+        if stripWidth <= 0:
+            
+            return [(-1, -1), (-1, -1), -1]
         
-        # For each pixel in the top row, iterate through each pixel in the bottom row
-        for i in range(end - start):
+        points = numpy.asarray(points, dtype=numpy.int64).reshape(-1, 2)
+        
+        # Every pixel in the top row paired with every pixel in the bottom row, the top pixel varying slowest
+        top, bottom = self.getWindow(numpy.arange(start, end), numpy.arange(start, end))
+        
+        if self.pyramidFactor > 1:
+            
+            bestTop, bestBottom = self.getCoarseBestFit(points, start, end, height)
+            
+            # Refine at full resolution in the window around the coarse optimum
+            window = self.getWindow(self.getWindowRange(bestTop, start, end), self.getWindowRange(bestBottom, start, end))
+            result = self.getBestFitInWindow(points, window[0], window[1], height)
             
-            for j in range(end - start):
+            # Record how often the search in the window misses the exhaustive optimum
+            if self.verify:
                 
-                # Initialize sum variables
-                totalDist = 0
-                pointCount = 0
+                self.recordSearch(self.getBestFitInWindow(points, top, bottom, height)[:2], result[:2])
+            
+            return result
+        
+        return self.getBestFitInWindow(points, top, bottom, height)
+    
+    # Fits a line through the points from the candidate top and bottom pixels, starting from the vertical line through the mean of the points and abandoning every candidate once its distance passes the best candidate so far
+    def getPrunedBestFit(self, points, top, bottom, height, blockSize=1024, chunkSize=64):
+        
+        slope = bottom - top
+        length = numpy.sqrt(height * height + slope * slope)
+        
+        # Order the candidates from the vertical fit mean outwards, so the first candidate seeds the best distance
+        center = numpy.mean(points[:, 1]) if len(points) else (top[0] + top[-1]) / 2
+        order = numpy.argsort(numpy.abs(top - center) + numpy.abs(bottom - center), kind="stable")
+        
+        bestDist = numpy.inf
+        best = -1
+        
+        for block in [order[:1]] + [order[k:k + blockSize] for k in range(1, len(order), blockSize)]:
+            
+            totalCross = numpy.zeros(len(block), numpy.int64)
+            
+            for k in range(0, len(points), chunkSize):
                 
-                for point in points:
-                    
-                    # dist = self.getShortestDist(point, [(0, i + start), (height, j + start)]) * abs(((end - start) / 2) - point[1])
-                    dist = self.getShortestDist(point, [(0, i + start), (height, j + start)])
-                    
-                    totalDist += dist
-                    pointCount += 1
+                chunk = points[k:k + chunkSize]
                 
-                # Check and update minimum distance if necessary
-                if totalDist < minDist[2]:
+                totalCross += numpy.abs(height * (top[block, None] - chunk[:, 1]) + chunk[:, 0] * slope[block, None]).sum(axis=1)
+                
+                # Running distances only grow, so candidates past the best distance can never win, while ties are kept
+                keep = totalCross / length[block] <= bestDist
+                block = block[keep]
+                totalCross = totalCross[keep]
+                
+                if not len(block):
                     
-                    # Update top point, bottom point, sum of all distances between all the points and the line segment, and deviation
-                    minDist = [(0, i + start), (height, j + start), totalDist, pow(2, totalDist / (pointCount + 1)) / 10]
+                    break
+            
+            if not len(block):
+                
+                continue
+            
+            totalDist = totalCross / length[block]
+            
+            # The smallest distance wins, and the first candidate in the order of the exhaustive search breaks ties
+            i = numpy.lexsort((block, totalDist))[0]
+            
+            if totalDist[i] < bestDist or (totalDist[i] == bestDist and block[i] < best):
+                
+                bestDist = totalDist[i]
+                best = block[i]
+        
+        # Top point, bottom point and deviation
+        return [(0, int(top[best])), (height, int(bottom[best])), pow(2, float(bestDist) / (len(points) + 1)) / 10]
+    
+    # Returns every pair of a first and a second value, the first value varying slowest
+    def getWindow(self, firstValues, secondValues):
+        
+        return numpy.repeat(firstValues, len(secondValues)), numpy.tile(secondValues, len(firstValues))
+    
+    # Returns the values within the search window around a coarse optimum that lie between a starting and an ending value
+    def getWindowRange(self, center, start, end):
+        
+        return numpy.arange(max(start, center - self.pyramidWindow), min(end, center + self.pyramidWindow + 1))
+    
+    # Counts a coarse-to-fine search and whether its result differs from the exhaustive search
+    def recordSearch(self, exhaustiveResult, pyramidResult):
+        
+        self.searchCount += 1
+        
+        if exhaustiveResult != pyramidResult:
+            
+            self.mismatchCount += 1
+    
+    # Fits a line on points binned into squares of the pyramid factor, returning the full resolution top and bottom pixels at the centre of the best coarse line
+    def getCoarseBestFit(self, points, start, end, height):
         
-        # logOutput("Best Fit Strip : ", minDist)
-        # logOutput(minDist[3], " ", end='')
-        return [minDist[0], minDist[1], minDist[3]]
+        factor = self.pyramidFactor
+        
+        # Count the points in each bin
+        bins, weights = numpy.unique((points - [0, start]) // factor, axis=0, return_counts=True)
+        
+        coarseWidth = -(-(end - start) // factor)
+        coarseTop, coarseBottom = self.getWindow(numpy.arange(coarseWidth), numpy.arange(coarseWidth))
+        
+        best = self.getBestFitInWindow(bins, coarseTop, coarseBottom, max(1, height // factor), weights)
+        
+        return start + best[0][1] * factor + factor // 2, start + best[1][1] * factor + factor // 2
+    
+    # Fits a line through the points from the candidate top and bottom pixels, where each point can stand for several points
+    def getBestFitInWindow(self, points, top, bottom, height, weights=None):
+        
+        if self.prune and weights is None:
+            
+            return self.getPrunedBestFit(points, top, bottom, height)
+        
+        # The perpendicular distance of a point (y, x) from a line is |height * (top - x) + y * (bottom - top)| / length
+        slope = (bottom - top)[:, None]
+        length = numpy.sqrt(height * height + slope * slope)
+        
+        totalCross = numpy.zeros(len(top), numpy.int64)
+        chunkSize = max(1, 4194304 // len(top))
+        
+        # Sum the integer numerators of the distances of all the points from every line at once, in chunks of points, so the sums do not depend on the order of the points
+        for k in range(0, len(points), chunkSize):
+            
+            chunk = points[k:k + chunkSize]
+            cross = numpy.abs(height * (top[:, None] - chunk[:, 1]) + chunk[:, 0] * slope)
+            
+            if weights is not None:
+                
+                cross = cross * weights[k:k + chunkSize]
+            
+            totalCross += cross.sum(axis=1)
+        
+        totalDist = totalCross / length[:, 0]
+        
+        # The first line with the smallest sum of distances is the best fit
+        best = numpy.argmin(totalDist)
+        
+        pointCount = len(points) if weights is None else int(weights.sum())
+        
+        # Top point, bottom point and deviation
+        return [(0, int(top[best])), (height, int(bottom[best])), pow(2, float(totalDist[best]) / (pointCount + 1)) / 10]
     
     # Fits a line in a subset of points that reside between a starting value and an ending value of y
     def getStrictFit(self, points, rows, height, width):
         
+        # Index the points once for all the strips
+        points = self.getPointIndex(points)
+        
         # Calculate the width of each strip
         stripWidth = round(width / rows)
         
@@ -447,57 +717,27 @@ class Line(object):
         # Calculate the width of each strip
         stripWidth = round(width / rows)
         
-        # Initialize the minimum distance as infinity
-        minSS = [(-1, -1), (-1, -1), sys.maxsize]
+        pointIndex = self.getPointIndex(points)
         
         subPoints = []
         
         # Group the points into their respective strips
         for i in range(rows):
             
-            subPoints.append(self.getSubPoints(points, (stripWidth * (i + self.sideTrim)), (stripWidth * (i + 1 - self.sideTrim))))
+            subPoints.append(self.getSubPoints(pointIndex, (stripWidth * (i + self.sideTrim)), (stripWidth * (i + 1 - self.sideTrim))))
+        
+        # Get Y coordinates of first line and last line with the minimum sum of squares
+        stripStats = self.getStripStats(pointIndex, rows, stripWidth)
+        minFirstLineY, minLastLineY = self.getStrictBounds(stripStats, rows, stripWidth)
+        
+        # Sum of all distances between all the points and the line segments
+        totalDist = sum(self.getStrictSS(stripStats, minFirstLineY, minLastLineY))
+        pointCount = int(stripStats[0].sum())
+        
+        # The deviations are measured from the lines of the last candidate of the search
+        firstLineY = stripWidth - 1
+        lastLineY = stripWidth - 1 + (stripWidth * (rows - 1))
         
-        for i in range(stripWidth):
-            
-            for j in range(stripWidth):
-                
-                # Initialize sum variables
-                totalDist = 0
-                pointCount = 0
-                
-                firstLineY = i
-                lastLineY = j + (stripWidth * (rows - 1))
-                
-                lineGap = (lastLineY - firstLineY) / (rows - 1)
-                
-                linesY = []
-                
-                for k in range (rows):
-                    
-                    linesY.append(firstLineY + (k * lineGap))
-                
-                for k in range (rows):
-                    
-                    subDist = 0
-                    subCount = 0
-                    
-                    for subpoint in subPoints[k]:
-                        
-                        # Count sum of square
-                        ss = (subpoint[1] - linesY[k]) ** 2
-                        
-                        subDist += ss
-                        subCount += 1
-                        
-                        totalDist += ss
-                        pointCount += 1
-                
-                # Check and update minimum distance if necessary
-                if totalDist < minSS[2]:
-                    
-                    # Update Y coordinates of first line, last line and sum of all distances between all the points and the line segment
-                    minSS = [firstLineY, lastLineY, totalDist]
-                    
         lineGap = (lastLineY - firstLineY) / (rows - 1)
         strictLinesY = [] 
             
@@ -512,7 +752,7 @@ class Line(object):
             strictLinesY.append(strictLine)
             distArr = []
             
-            for subpoint in subPoints[row]:        
+            for subpoint in subPoints[row].tolist():        
                                
                 dist = abs(subpoint[1] - strictLine)
                 distArr.append(dist)
@@ -523,7 +763,7 @@ class Line(object):
         totalDev = statistics.stdev(totalDistArr)   
         
         # Index 2 : MSE ; Index 3 : sample standard deviation of the distances in each segment; Index 4 sample standard deviation of the distances in all segments;
-        return [minSS[0], minSS[1], minSS[2] / pointCount, devArr, totalDev] 
+        return [minFirstLineY, minLastLineY, totalDist / pointCount, devArr, totalDev] 
     
     # Strict fitting model using MSE Not counting for SD
     def getStrictFit3(self, points, rows, width):        
@@ -531,151 +771,190 @@ class Line(object):
         # Calculate the width of each strip
         stripWidth = round(width / rows)
         
-        # Initialize the minimum distance as infinity
-        minSS = [(-1, -1), (-1, -1), sys.maxsize]
+        # Get Y coordinates of first line and last line with the minimum sum of squares
+        stripStats = self.getStripStats(points, rows, stripWidth)
+        firstLineY, lastLineY = self.getStrictBounds(stripStats, rows, stripWidth)
+            
+        # Append the MSE of all strict lines
+        MSEArr = []
+        totalPoints = 0
+        totalDist = 0
         
-        subPoints = []
+        for SS_eachSeg, numOfsub in zip(self.getStrictSS(stripStats, firstLineY, lastLineY), stripStats[0].tolist()):
+            totalDist += SS_eachSeg
+            if(numOfsub == 0):
+                MSEArr.append(0)
+            else:
+                MSEArr.append(SS_eachSeg / numOfsub)
+            totalPoints = totalPoints + numOfsub
+               
+        # Index 2 : MSE ; Index 3 : sample standard deviation of the distances in each segment; Index 4 sample standard deviation of the distances in all segments;
+        return [firstLineY, lastLineY, totalDist / totalPoints, MSEArr] 
+    
+    # fit vertical lines but not with strict intervals
+    def getVerticalFit(self, points, rows, width):
+            # Calculate the width of each strip
+        stripWidth = round(width / rows)
         
-        # Group the points into their respective strips
-        for i in range(rows):
+        verticalLines = []
+        totalSS = 0
+        MSEArr = []
+        totalPointsNum = 0
+        
+        # Number of points, sum and sum of squares of the Y coordinates in each strip
+        for count, sumY, sumSquaresY in self.getStripStats(points, rows, stripWidth).T.tolist():
+            # If the fit equation is y = a*x + b, you can find the intercept b that best fits you data, given a fixed slope a = A, as: 
+            # b = np.mean(y - A*x) #In this case fit x = b, A = 0
+            intercept = sumY / count
+            verticalLines.append(intercept)
             
-            subPoints.append(self.getSubPoints(points, (stripWidth * (i + self.sideTrim)), (stripWidth * (i + 1 - self.sideTrim))))
+            # Sum of squares around the mean
+            segSS = (count * sumSquaresY - sumY * sumY) / count
+            totalSS += segSS
+             
+            MSEArr.append(segSS / count)
+            totalPointsNum += count
         
-        for i in range(stripWidth):
+        # index 0 : intecept of all fitting lines, index 1 : totalMSE; index 2: array of mse in each segment.
+        return [verticalLines, totalSS / totalPointsNum, MSEArr]     
+    
+    # Fits evenly spaced vertical lines on the strongest period of the count of points per column, without any search
+    def getSpectralFit(self, points, width, minRows=2, maxRows=None):
+        
+        rows, lineGap, linesY = estimateRowPeriod(getColumnProfile(points, width), minRows, maxRows)
+        
+        # index 0 : row count, index 1 : gap between the lines, index 2 : Y coordinates of the lines
+        return [rows, lineGap, linesY]
+    
+    # Detects near vertical rows by letting every point vote for the lines through it within a maximum angle, returning the line segments of the rows with the most votes from left to right
+    def getHoughFit(self, points, rows, height, width, maxAngle=10, angleStep=0.5, minGap=None):
+        
+        points = numpy.asarray(points.points if isinstance(points, PointIndex) else points, dtype=numpy.float64).reshape(-1, 2)
+        
+        # Lines are x = offset + y * tan(angle), the offset being the Y coordinate of the line at the top of the image
+        slopes = numpy.tan(numpy.radians(numpy.arange(-maxAngle, maxAngle + angleStep / 2, angleStep)))
+        margin = int(numpy.ceil(height * numpy.abs(slopes).max()))
+        offsetCount = width + 2 * margin
+        
+        # Vote for the offset of every point at every angle in one pass
+        offsets = numpy.rint(points[:, 1] - points[:, 0] * slopes[:, None]).astype(numpy.int64) + margin
+        bins = (numpy.arange(len(slopes))[:, None] * offsetCount + offsets).ravel()
+        votes = numpy.bincount(bins, minlength=len(slopes) * offsetCount).reshape(len(slopes), offsetCount)
+        
+        # Rows are at least half a row apart unless specified
+        if minGap is None:
             
-            for j in range(stripWidth):
-                
-                # Initialize sum variables
-                totalDist = 0
-                pointCount = 0
-                firstLineY = i
-                lastLineY = j + (stripWidth * (rows - 1))
-                
-                lineGap = (lastLineY - firstLineY) / (rows - 1)
-                
-                linesY = []
-                
-                for k in range (rows):
-                    
-                    linesY.append(firstLineY + (k * lineGap))
-                
-                for k in range (rows):
-                    
-                    subDist = 0
-                    subCount = 0
-                    
-                    for subpoint in subPoints[k]:
-                        
-                        # Count sum of square
-                        ss = (subpoint[1] - linesY[k]) ** 2
-                        
-                        subDist += ss
-                        subCount += 1
-                        
-                        totalDist += ss
-                        pointCount += 1
+            minGap = max(1, int(width / (2 * rows)))
+        
+        segments = []
+        rowVotes = []
+        
+        # Take the line with the most votes and clear the offsets around it at every angle, once per row
+        for i in range(rows):
+            
+            angle, offset = numpy.unravel_index(numpy.argmax(votes), votes.shape)
+            
+            if votes[angle, offset] == 0:
                 
-                # Check and update minimum distance if necessary
-                if totalDist < minSS[2]:
-                    
-                    # Update Y coordinates of first line, last line and sum of all distances between all the points and the line segment
-                    minSS = [firstLineY, lastLineY, totalDist]
-
-        firstLineY = minSS[0]
-        lastLineY = minSS[1]
-        lineGap = (lastLineY - firstLineY) / (rows - 1)
-        # strictLinesY = [] 
+                break
             
-        # Append all strict lines
-        MSEArr = []
-        totalPoints = 0
+            rowVotes.append(int(votes[angle, offset]))
+            segments.append([(0, int(offset - margin)), (height, float(offset - margin + height * slopes[angle]))])
+            
+            votes[:, max(0, offset - minGap):offset + minGap + 1] = 0
         
-        for row in range(rows):       
-            strictLine = firstLineY + lineGap * row
-            # strictLinesY.append(strictLine)
-            SS_eachSeg = 0
-            
-            # logOutput(subPoints[row])
-            # logOutput("length of subpoints is %d",len(subPoints[row]))
-            for subpoint in subPoints[row]:                  
-                SS = (subpoint[1] - strictLine) ** 2
-                SS_eachSeg = SS_eachSeg + SS
-            numOfsub = len(subPoints[row])    
-            if(numOfsub == 0):
-                MSEArr.append(0)
-            else:
-                MSEArr.append(SS_eachSeg / len(subPoints[row]))
-            totalPoints = totalPoints + len(subPoints[row])
-               
-        # logOutput(pointCount)
-        # Index 2 : MSE ; Index 3 : sample standard deviation of the distances in each segment; Index 4 sample standard deviation of the distances in all segments;
-        return [minSS[0], minSS[1], minSS[2] / totalPoints, MSEArr] 
+        order = sorted(range(len(segments)), key=lambda i: segments[i][0][1])
+        
+        # index 0 : line segments from left to right, index 1 : votes of each line segment
+        return [[segments[i] for i in order], [rowVotes[i] for i in order]]
     
-    # fit vertical lines but not with strict intervals
-    def getVerticalFit(self, points, rows, width):
-            # Calculate the width of each strip
-        stripWidth = round(width / rows)
+    # Counts the points in each strip along with the sum and the sum of squares of their Y coordinates
+    def getStripStats(self, points, rows, stripWidth):
         
-        subPoints = []
+        # Strip i holds the columns from stripWidth * (i + sideTrim) inclusive to stripWidth * (i + 1 - sideTrim) exclusive
+        strips = numpy.arange(rows)
         
-        # Group the points into their respective strips
-        for i in range(rows):
+        return self.getPointIndex(points).getStats(stripWidth * (strips + self.sideTrim), stripWidth * (strips + 1 - self.sideTrim))
+    
+    # Gets the Y coordinates of the first and the last of the evenly spaced lines with the minimum sum of squares over all the strips
+    def getStrictBounds(self, stripStats, rows, stripWidth):
+        
+        lastOffset = stripWidth * (rows - 1)
+        
+        # Every first line in the first strip paired with every last line in the last strip
+        firstLineY, lastLineY = self.getWindow(numpy.arange(stripWidth), numpy.arange(stripWidth) + lastOffset)
+        
+        if self.pyramidFactor > 1:
             
-            subPoints.append(self.getSubPoints(points, (stripWidth * (i + self.sideTrim)), (stripWidth * (i + 1 - self.sideTrim))))
+            # Search every pyramid factor-th pair of lines first
+            coarseLines = numpy.arange(0, stripWidth, self.pyramidFactor)
+            coarseWindow = self.getWindow(coarseLines, coarseLines + lastOffset)
+            bestFirst, bestLast = self.getStrictBoundsInWindow(stripStats, coarseWindow[0], coarseWindow[1])
             
-        verticalLines = []
-        totalSS = 0
-        MSEArr = []
-        totalPointsNum = 0
-        
-        for subPoint in subPoints:
-            # If the fit equation is y = a*x + b, you can find the intercept b that best fits you data, given a fixed slope a = A, as: 
-            # b = np.mean(y - A*x) #In this case fit x = b, A = 0
-            intercept = numpy.mean(numpy.array(subPoint)[:, 1])
-            verticalLines.append(intercept)
-            segSS = 0
-            for point in subPoint:
-                pointSS = (point[1] - intercept) ** 2
-                totalSS += pointSS
-                segSS += pointSS
-             
-            MSEArr.append(segSS / len(subPoint))
-            totalPointsNum += len(subPoint)
+            # Refine at full resolution in the window around the coarse optimum
+            window = self.getWindow(self.getWindowRange(bestFirst, 0, stripWidth), self.getWindowRange(bestLast, lastOffset, lastOffset + stripWidth))
+            result = self.getStrictBoundsInWindow(stripStats, window[0], window[1])
+            
+            # Record how often the search in the window misses the exhaustive optimum
+            if self.verify:
+                
+                self.recordSearch(self.getStrictBoundsInWindow(stripStats, firstLineY, lastLineY), result)
+            
+            return result
         
-        # index 0 : intecept of all fitting lines, index 1 : totalMSE; index 2: array of mse in each segment.
-        return [verticalLines, totalSS / totalPointsNum, MSEArr]     
+        return self.getStrictBoundsInWindow(stripStats, firstLineY, lastLineY)
     
-    # Gets the coordinates of all the white pixels in the image
-    def getPoints(self, img):
+    # Gets the Y coordinates of the first and the last of the evenly spaced lines with the minimum sum of squares among the candidate pairs
+    def getStrictBoundsInWindow(self, stripStats, firstLineY, lastLineY):
+        
+        count, sumY, sumSquaresY = stripStats
+        gaps = len(count) - 1
+        k = numpy.arange(gaps + 1)
+        
+        # Y coordinates of the lines multiplied by the number of gaps, which keeps the sums of squares exact integers
+        linesY = firstLineY[:, None] * (gaps - k) + lastLineY[:, None] * k
         
-        points = []
+        # Sum of squares of each strip is count * line^2 - 2 * line * sum + sum of squares, scaled by the square of the number of gaps
+        totalSS = (count * linesY * linesY - 2 * gaps * linesY * sumY + gaps * gaps * sumSquaresY).sum(axis=1)
         
-        row = len(img)
-        col = len(img[0])
+        # The first candidate with the minimum sum of squares is kept
+        best = int(numpy.argmin(totalSS))
         
-        for i in range(row):
+        return int(firstLineY[best]), int(lastLineY[best])
+    
+    # Gets the sum of squares of each strip around its evenly spaced line, computed exactly from the strip statistics
+    def getStrictSS(self, stripStats, firstLineY, lastLineY):
+        
+        gaps = len(stripStats[0]) - 1
+        SSArr = []
+        
+        for k, (count, sumY, sumSquaresY) in enumerate(stripStats.T.tolist()):
             
-            for j in range(col):
-                
-                # Check for white pixel
-                if img[i][j][0] == 255:
-                    
-                    points.append((i, j))
+            # Y coordinate of the line multiplied by the number of gaps
+            lineY = firstLineY * (gaps - k) + lastLineY * k
+            
+            SSArr.append((count * lineY * lineY - 2 * gaps * lineY * sumY + gaps * gaps * sumSquaresY) / (gaps * gaps))
+        
+        return SSArr
+    
+    # Gets the coordinates of all the white pixels in the image
+    def getPoints(self, img, columnMajor=False):
         
-        return points
+        return getPoints(img, columnMajor)
     
     # Gets the coordinates of all the white pixels in the image that reside between a starting value and an ending value of y
     def getSubPoints(self, points, start, end):
         
-        subPoints = []
+        return self.getPointIndex(points).getSubPoints(start, end)
+    
+    # Returns the point index of a list of points, or the point index itself if the points are already indexed
+    def getPointIndex(self, points):
         
-        for point in points:
+        if isinstance(points, PointIndex):
             
-            if point[1] >= start and point[1] < end:
-                
-                subPoints.append(point)
-                
-        return subPoints
+            return points
+        
+        return PointIndex(points)
     
     def getSubDistSum(self, points, start, end, segment):
         
@@ -715,6 +994,99 @@ class Line(object):
         return m, b
 
 
+# Class for looking up the points that reside between a starting value and an ending value of y, with the points sorted by y
+class PointIndex(object):
+    
+    # Constructor
+    def __init__(self, points):
+        
+        points = numpy.asarray(points, dtype=numpy.int64).reshape(-1, 2)
+        
+        # Points sorted by their Y coordinate, keeping the order of points with the same Y coordinate
+        self.points = points[numpy.argsort(points[:, 1], kind="stable")]
+        self.columns = self.points[:, 1]
+        
+        # Prefix sums of the number of points, of their Y coordinates and of their squares
+        self.prefix = numpy.zeros((3, len(self.points) + 1), numpy.int64)
+        self.prefix[0, 1:] = numpy.arange(1, len(self.points) + 1)
+        self.prefix[1, 1:] = numpy.cumsum(self.columns)
+        self.prefix[2, 1:] = numpy.cumsum(self.columns * self.columns)
+    
+    # Returns the number of points
+    def __len__(self):
+        
+        return len(self.points)
+    
+    # Returns the offsets of the first point at or after each starting value and of the first point at or after each ending value
+    def getOffsets(self, start, end):
+        
+        return numpy.searchsorted(self.columns, start, "left"), numpy.searchsorted(self.columns, numpy.maximum(start, end), "left")
+    
+    # Returns the points that reside between a starting value and an ending value of y as a view on the index
+    def getSubPoints(self, start, end):
+        
+        first, last = self.getOffsets(start, end)
+        
+        return self.points[first:last]
+    
+    # Counts the points between each pair of starting and ending values of y along with the sum and the sum of squares of their Y coordinates
+    def getStats(self, start, end):
+        
+        first, last = self.getOffsets(start, end)
+        
+        return self.prefix[:, last] - self.prefix[:, first]
+
+
+# Class for per-cluster statistics of a binary image, computed once and reused to filter the image at any threshold
+class Clusters(object):
+    
+    # Constructor
+    def __init__(self, img):
+        
+        self.shape = numpy.shape(getMask(img))
+        self.labels, self.sizes, self.seeds = labelClusters(img)
+        
+        # Coordinates and cluster index of every white pixel, in raster order
+        whitePixels = numpy.flatnonzero(self.labels)
+        rows, cols = numpy.divmod(whitePixels, self.shape[1])
+        index = self.labels.ravel()[whitePixels] - 1
+        count = len(self.sizes)
+        
+        # Centroid of each cluster as (row, column)
+        self.centroids = numpy.column_stack((numpy.bincount(index, rows, count), numpy.bincount(index, cols, count))) / numpy.maximum(self.sizes, 1)[:, None]
+        
+        # Bounding box of each cluster as (top, left, bottom, right), all inclusive
+        top = self.seeds // self.shape[1]
+        left = numpy.full(count, self.shape[1], numpy.intp)
+        bottom = numpy.zeros(count, numpy.intp)
+        right = numpy.zeros(count, numpy.intp)
+        numpy.minimum.at(left, index, cols)
+        numpy.maximum.at(bottom, index, rows)
+        numpy.maximum.at(right, index, cols)
+        
+        self.bboxes = numpy.column_stack((top, left, bottom, right))
+        
+        # Number of columns spanned by each cluster
+        self.colSpans = right - left + 1
+    
+    # Returns the cluster filtered image for a threshold, with the same pixel values filterClusters produces
+    def getFilteredImg(self, thresh):
+        
+        return getSeedImg(self.shape, self.sizes, self.seeds, thresh)
+    
+    # Returns the cluster filtered images for a list of thresholds
+    def getFilteredImages(self, threshList):
+        
+        return [self.getFilteredImg(thresh) for thresh in threshList]
+    
+    # Returns the mask of the pixels of all clusters with pixel density above a threshold
+    def getClusterMask(self, thresh):
+        
+        keep = numpy.concatenate(([False], self.sizes > thresh))
+        
+        return keep[self.labels]
+
+
 # Converts an Image object to an RGB Image object
 def convertToRGB(img):
     
@@ -733,15 +1105,9 @@ def adjustLevel(img, minv=0, maxv=255, gamma=1.0):
         
         raise ValueError("Image not in RGB mode")
 
-    newImg = img.copy()
-
     leveller = Level(minv, maxv, gamma)
-    levelled_data = [
-        leveller.convertAndLevel(data)
-        for data in img.getdata()]
-    newImg.putdata(levelled_data)
-    
-    return newImg
+
+    return Image.fromarray(leveller.levelArray(numpy.asarray(img)), "RGB")
 
 
 # Converts the image to greyscale
@@ -752,9 +1118,149 @@ def convertToGreyscale(img):
 
 # Coverts the image to binary mode
 def binarizeImg(img):
-    
+
     return img.convert('1')
 
+
+# Converts a binary image to the sci-kit image array expected by the cluster filter, where white pixels are 255
+def toSKImg(img):
+    
+    return numpy.asarray(img, dtype=bool).astype(numpy.uint8) * 255
+
+
+# Returns the white pixels of a cluster filtered image as they appear once it is saved in greyscale and read back
+def toFilteredMask(img):
+    
+    img = numpy.asarray(img)
+    
+    # Saving stretches the image between its darkest and its brightest value, so only the brightest value turns white
+    if img.max() == img.min():
+        
+        return numpy.zeros(img.shape, bool)
+    
+    return img == img.max()
+
+
+# Returns the white pixels of an image read from disk, or of a binary mask held in memory, as a boolean array
+def getMask(img):
+    
+    img = numpy.asarray(img)
+    
+    if img.dtype == bool:
+        
+        return img
+    
+    # Filtered images are read back with colour channels
+    if img.ndim == 3:
+        
+        return img[..., 0] == 255
+    
+    return img == 255
+
+
+# Returns the coordinates of all the white pixels of an image as an (N, 2) array of (y, x) pairs, in raster order or column by column
+def getPoints(img, columnMajor=False):
+    
+    mask = getMask(img)
+    
+    if columnMajor:
+        
+        x, y = numpy.nonzero(mask.T)
+        
+        return numpy.column_stack((y, x)).astype(numpy.int32)
+    
+    return numpy.argwhere(mask).astype(numpy.int32)
+
+
+# Saves a binary mask as a 1-bit PNG, or bit-packed with its shape in a NumPy archive, depending on the file extension
+def writeMask(fileName, mask):
+    
+    mask = numpy.asarray(mask, dtype=bool)
+    
+    if fileName.endswith(".npz"):
+        
+        numpy.savez(fileName, bits=numpy.packbits(mask, axis=None), shape=numpy.array(mask.shape))
+        
+    else:
+        
+        Image.fromarray(mask).save(fileName)
+
+
+# Reads a binary mask saved by writeMask, or the white pixels of any other image, as a boolean array
+def readMask(fileName):
+    
+    # Bit-packed masks are unpacked without decoding an image
+    if fileName.endswith(".npz"):
+        
+        with numpy.load(fileName) as data:
+            
+            shape = tuple(data["shape"])
+            
+            return numpy.unpackbits(data["bits"], count=int(numpy.prod(shape))).reshape(shape).view(bool)
+    
+    with Image.open(fileName) as img:
+        
+        # 1-bit images are read as booleans without any colour conversion
+        return getMask(numpy.asarray(img))
+
+
+# Converts, levels, greyscales, binarizes and trims an RGBA image in one stage, band by band over two shared buffers
+def preprocessImg(img, trimmer, minv=100, maxv=255, gamma=9.99, bandHeight=16):
+
+    if img.mode != "RGBA":
+
+        raise ValueError("Image not in RGBA mode")
+
+    width, height = img.size
+
+    leveller = Level(minv, maxv, gamma)
+
+    # Levelled image at 3 bytes per pixel, so every pixel is only levelled once, and the greyscale buffer handed to PIL for dithering
+    levelled = numpy.empty((height, width, 3), numpy.uint8)
+    grey = numpy.empty((height, width), numpy.uint8)
+
+    greySum = 0
+
+    for top in range(0, height, bandHeight):
+
+        levelled[top:top + bandHeight] = getLevelledBand(img, leveller, top, bandHeight)
+
+        # Accumulate the greyscale sum needed for the contrast mean
+        band = levelled[top:top + bandHeight].astype(numpy.uint32)
+        greySum += int(((band[..., 0] * 19595 + band[..., 1] * 38470 + band[..., 2] * 7471 + 0x8000) >> 16).sum())
+
+    mean = int(greySum / (height * width) + 0.5)
+
+    for top in range(0, height, bandHeight):
+
+        # Enhance contrast 50 times around the mean grey level
+        band = levelled[top:top + bandHeight].astype(numpy.int32)
+        band = numpy.clip(mean + 50 * (band - mean), 0, 255)
+
+        # Convert to greyscale the way PIL does before dithering to binary mode
+        grey[top:top + bandHeight] = (band[..., 0] * 299 + band[..., 1] * 587 + band[..., 2] * 114) // 1000
+
+    # Binarize image
+    binImg = Image.frombuffer("L", (width, height), grey, "raw", "L", 0, 1).convert('1')
+
+    return trimmer.smartTrim(binImg)
+
+
+# Returns a band of rows of an RGBA Image object pasted on a white background and level adjusted, without copying the rest of the image
+def getLevelledBand(img, leveller, top, bandHeight):
+
+    width, height = img.size
+
+    band = numpy.asarray(img.crop((0, top, width, min(top + bandHeight, height)))).astype(numpy.uint32)
+
+    # Paste on a white background using the alpha band as mask, rounded the same way as PIL
+    alpha = band[..., 3:]
+    pasted = band[..., :3] * alpha + 255 * (255 - alpha) + 128
+    pasted = ((pasted >> 8) + pasted) >> 8
+
+    # Adjust image level
+    return leveller.levelArray(pasted)
+
 # Threshold Segmentation for test purposes
 # def thresholdSegmentation():
 #     
@@ -835,373 +1341,817 @@ def binarizeImg(img):
 # Filters clusters based on pixel density and represents each cluster with a single point (dot)
 def filterClusters(img, thresh):
     
-    # Initialize cluster count
-    clusCount = 0
-    row = len(img)
-    col = len(img[0])
+    labels, sizes, seeds = labelClusters(img)
+    
+    seedImg = getSeedImg(labels.shape, sizes, seeds, thresh)
     
-    for i in range(row):
+    # Boolean masks cannot hold the values of the seeds, so a new image is returned for them instead
+    if numpy.asarray(img).dtype != numpy.uint8:
         
-        for j in range(col):
-            
-            # Check for white pixel
-            if img[i][j] == 255:
-                
-                img[i][j] = 1
-                
-                # Initialize size of cluster as mutable object and set the minimum value to 1
-                size = [1]
-                size[0] = 1 
-                # size.append(1)
-                
-                # Perform DFS
-                dfsWithSize(i, j, img, row, col, size)
-                
-                # Only cluster with pixel density above a certain threshold is kept
-                if size[0] > thresh:
-                    
-                    img[i][j] = 255
-                
-                # Update cluster count
-                clusCount += 1
+        return seedImg
+    
+    img[...] = seedImg
     
     return img
 
 
-# DFS search that keeps track of the size (i.e. pixel density)
-def dfsWithSize(i, j, img, row, col, size):
+# Returns an image where only the first pixel of each cluster is kept, set to white if its pixel density is above a certain threshold
+def getSeedImg(shape, sizes, seeds, thresh):
     
-    if(i < 0 or i >= row or j < 0 or j >= col):
-        
-        return
+    seedImg = numpy.zeros(shape, numpy.uint8)
+    seedImg.ravel()[seeds] = numpy.where(sizes > thresh, 255, 1)
     
-    if(img[i][j] == 0):
-        
-        return
+    return seedImg
+
+
+# Labels the 4-connected clusters of white pixels in one sweep, returning the label image, the size of each cluster and the flat index of its first pixel in raster order
+def labelClusters(img):
     
-    if(img[i][j] == 255):
-        
-        img[i][j] = 0
-        size[0] += 1
+    labels, count = label(getMask(img), connectivity=1, return_num=True)
+    
+    # Label 0 is the background
+    flatLabels = labels.ravel()
+    sizes = numpy.bincount(flatLabels, minlength=count + 1)[1:]
     
-    dfsWithSize(i + 1, j, img, row, col, size)
-    dfsWithSize(i, j + 1, img, row, col, size)
-    dfsWithSize(i - 1, j, img, row, col, size)
-    dfsWithSize(i, j - 1, img, row, col, size)
+    # First occurrence of each label among the white pixels, which are already in raster order
+    whitePixels = numpy.flatnonzero(flatLabels)
+    seeds = whitePixels[numpy.unique(flatLabels[whitePixels], return_index=True)[1]]
+    
+    return labels, sizes, seeds
 
 
-# Processes all images in an image list
-def bulkProcess(imageList):
+# Applies a function to every item, in a pool of worker processes when more than one worker is requested, and yields the results in the order of the items while keeping at most inFlight items submitted at a time
+def imapImages(func, items, workers=1, inFlight=None, pool=None):
     
-    processedImageList = []
-    
-    for i, img in enumerate(imageList):
+    if workers > 1:
+        
+        if inFlight is None:
+            
+            inFlight = 2 * workers
         
-        # Convert image to RGB
-        rgb = convertToRGB(img)
+        # Use the given pool of worker processes, or a pool of its own otherwise
+        ownPool = pool is None
         
-        # Adjust image level
-        levelledImg = adjustLevel(rgb, 100, 255, 9.99)
+        if ownPool:
+            
+            pool = openPool(workers)
         
-        # Convert to greyscale
-        grayImg = convertToGreyscale(levelledImg)
+        pending = collections.deque()
         
-        # Binarize image
-        binImg = binarizeImg(grayImg)
+        try:
+            
+            for item in items:
+                
+                pending.append(pool.apply_async(func, (item,)))
+                
+                # Wait for the oldest item once the limit of items in flight is reached
+                if len(pending) >= inFlight:
+                    
+                    yield pending.popleft().get()
+            
+            while pending:
+                
+                yield pending.popleft().get()
         
-        # Initialize trimmer
-        trimmer = Trim(0.1, 1)
+        finally:
+            
+            if ownPool:
+                
+                closePool(pool)
+    
+    else:
         
-        # Trim image (Naive)
-        trimmedImg = trimmer.smartTrim(binImg)
+        for item in items:
+            
+            yield func(item)
+
+
+# Applies a function to every item in a list and returns the results in the order of the items, so the index of each image matches its position in the list
+def mapImages(func, items, workers=1, message=None, pool=None):
+    
+    results = []
+    
+    for i, result in enumerate(imapImages(func, items, workers, pool=pool)):
         
-        # Update processed image list
-        processedImageList.append(trimmedImg)
+        results.append(result)
         
-        # Display status
-        logOutput("Image {:03d}.png processing completed".format(i))
+        # Display status from the parent process only
+        if message is not None:
+            
+            logOutput(message.format(i))
+    
+    return results
+
+
+# Processes a single image
+def processImg(img):
+    
+    # Initialize trimmer
+    trimmer = Trim(0.1, 1)
+    
+    # Convert, level, greyscale, binarize and trim image
+    return preprocessImg(img, trimmer, 100, 255, 9.99)
+
+
+# Processes all images in an image list
+def bulkProcess(imageList, workers=1, pool=None):
     
-    return processedImageList
+    return mapImages(processImg, imageList, workers, "Image {:03d}.png processing completed", pool)
 
 
 # Filters clusters in all images in an image list
-def bulkFilter(imageList, thresh):
+def bulkFilter(imageList, thresh, workers=1, pool=None):
+    
+    # Filter clusters by pixel density and dot representation
+    return mapImages(functools.partial(filterClusters, thresh=thresh), imageList, workers, "Image {:03d}.png cluster filtering completed", pool)
+
+
+# Computes the cluster statistics of all images in an image list once, so they can be filtered at several thresholds
+def bulkClusters(imageList, workers=1):
+    
+    return mapImages(Clusters, imageList, workers, "Image {:03d}.png cluster statistics completed")
+
+
+# Fits the lines of a single candidate row count with the best fit or the strict fit algorithm, returning the average deviation/MSE and the fit
+def fitRowCount(line, points, width, height, algorithm, rows):
+    
+    if algorithm == "strict":
+        
+        # Execute strict fit algorithm
+        strictBounds = line.getStrictFit3(points, rows, width)  # MSE Minimization Variation
+        
+        return strictBounds[2], strictBounds
     
-    filteredImageList = []
+    # Width of each strip
+    stripWidth = round(width / rows)
     
-    for i, img in enumerate(imageList):
+    # Execute best fit algorithm
+    segmentsBF = []
+    totalMSEBF = 0
+    
+    for i in range(rows):
         
-        # Filter clusters by pixel density and dot representation
-        filteredImg = filterClusters(img, thresh)
+        subPoints = line.getSubPoints(points, (stripWidth * (i + line.sideTrim)), (stripWidth * (i + 1 - line.sideTrim)))
         
-        # Update filtered image list
-        filteredImageList.append(filteredImg)
+        # Get the segmentBF using the best fitting model AND the deviation/MSE
+        segmentBF = line.getBestFit(subPoints, i * stripWidth, (i + 1) * stripWidth, height)
         
-        # Display status
-        logOutput("Image {:03d}.png cluster filtering completed".format(i))
+        # Append ONLY the line segmentBF to the list of line segments
+        segmentsBF.append((segmentBF[0], segmentBF[1]))
         
-    return filteredImageList
+        # Update deviation/MSE
+        totalMSEBF += segmentBF[2]
+    
+    # Record average deviation/MSE
+    return totalMSEBF / rows, segmentsBF
 
 
-def imageProcessFull(imgName):
+# Sets the candidate fit of a row count search in a worker process, so the points are only sent once per worker
+def setRowCountFit(fit):
     
-    logOutput("Starting image processing..")
+    global rowCountFit
     
-    # Initialize process handler
-    handlerProcess = File(INPUTFOLDERNAME, INTERMEDFOLDERNAME)
+    rowCountFit = fit
     
-    # determine mode of operation; batch or single
-    if (imgName == "batch"):
+    # Hold the worker until every other worker has taken its copy as well
+    if workerBarrier is not None:
         
-        # Get all images in the folder
-        imageList = handlerProcess.getImages()
-        
-    else:
-        
-        # Initialize an empty image list
-        imageList = []
-        
-        # Get image
-        imageList.append(handlerProcess.getImg(imgName))
-    
-    # Process image
-    processedImageList = bulkProcess(imageList)
+        workerBarrier.wait()
+
+
+# Sets the barrier shared by the workers of a pool in a worker process
+def setWorkerBarrier(barrier):
     
-    # Save image
-    handlerProcess.setImages(processedImageList)
+    global workerBarrier
     
-    logOutput("All images have been processed successfully")
+    workerBarrier = barrier
+
+
+# Opens a pool of worker processes that can be kept for a whole batch of images
+def openPool(workers):
     
-    logOutput("Starting image filtering..")
+    return multiprocessing.Pool(workers, setWorkerBarrier, (multiprocessing.Barrier(workers),))
+
+
+# Closes a pool of worker processes once the work left in it is done
+def closePool(pool):
     
-    # Initialize filter handler
-    handlerFilter = File(INTERMEDFOLDERNAME, OUTPUTFOLDERNAME)
+    # Workers are closed instead of terminated since pygame takes over their termination signal
+    pool.close()
+    pool.join()
+
+
+# Fits a single candidate row count in a worker process
+def fitRowCountWorker(algorithm, rows):
     
-    # Get image
-    imageList = handlerFilter.getSKImages()
+    return rowCountFit(algorithm, rows)
+
+
+# Checks if the deviation/MSE of the last candidate row count went up from the minimum of the ones before it
+def isRowCountSearchDone(results):
     
-    # Cluster filter image
-    filteredImageList = bulkFilter(imageList, 1)
+    return len(results) > 1 and results[-1][0] > min(result[0] for result in results[:-1])
+
+
+# Row count search policy that tries the row counts from 2 to MAXROWS + 1 in order until the deviation/MSE goes up
+def linearRowSearch(evaluate, points, width):
     
-    # Save image
-    handlerFilter.setSKImages(filteredImageList)
+    MSEArr = []
     
-    logOutput("All images have been filtered successfully")
+    for rows in range(2, MAXROWS + 2):
+        
+        MSEArr.append((evaluate(rows),))
+        
+        if isRowCountSearchDone(MSEArr):
+            
+            break
+
+
+# Row count search policy that brackets the minimum deviation/MSE with steps growing by the golden ratio, then narrows the bracket down with a golden-section search
+def goldenRowSearch(evaluate, points, width):
     
-    logOutput("Starting row count estimation..")
+    ratio = (1 + 5 ** 0.5) / 2
     
-    # Specify row count estimation and line fitting parameters
-    lineFitAlg = "overlap"
-    sideTrim = 0.10
-    draw = False
+    # Grow the steps until the deviation/MSE goes up or the maximum row count is reached
+    bracket = [2, 3]
     
-    for x in range(len(imageList)):
-        
-        # Set current minimum average deviation/MSE to infinity
-        minMSEBF = minMSESF = sys.maxsize
+    while bracket[-1] < MAXROWS + 1 and evaluate(bracket[-1]) <= evaluate(bracket[-2]):
         
-        # Initialize row count
-        estRowBF = estRowSF = -1
+        bracket.append(min(MAXROWS + 1, bracket[-1] + max(1, round((bracket[-1] - bracket[-2]) * ratio))))
+    
+    low = bracket[-3] if len(bracket) > 2 else bracket[0]
+    high = bracket[-1]
+    
+    # Narrow the bracket down, keeping the side of the smaller deviation/MSE
+    while high - low > 2:
         
-        fileName = "filtered_images/%03d.png" % x
+        step = round((high - low) / ratio)
+        left = max(low + 1, high - step)
+        right = min(high - 1, low + step)
         
-        img = None
+        if left >= right:
+            
+            left, right = right - 1, right
         
-        # Open a single image
-        try:
+        if evaluate(left) <= evaluate(right):
             
-            img = imread(fileName)
+            high = right
             
-        except FileNotFoundError:
+        else:
             
-            logOutput ("Invalid fileName")
+            low = left
+    
+    for rows in range(low, high + 1):
         
-        # Image properties
-        height = len(img)
-        width = len(img[0])
+        evaluate(rows)
+
+
+# Row count search policy that starts from the row count of the strongest period of the column profile and moves to a neighbouring row count while the deviation/MSE goes down
+def spectralRowSearch(evaluate, points, width):
+    
+    rows = getSpectralRowCount(points, width)
+    
+    while True:
         
-        line = Line(sideTrim)
-        points = line.getPoints(img)
+        neighbours = [r for r in (rows - 1, rows + 1) if 2 <= r <= MAXROWS + 1]
+        bestNeighbour = min(neighbours, key=evaluate)
         
-        # Flags to continue algorithm until completed
-        continueBF = True
-        continueSF = True
+        if evaluate(bestNeighbour) >= evaluate(rows):
+            
+            break
         
-        # Best fit tracker variables
-        estSegmentsBF = []
+        rows = bestNeighbour
+
+
+# Row count search policy that only tries the row counts around the row count of the strongest period of the column profile
+def fftRowSearch(evaluate, points, width, margin=1):
+    
+    rows = getSpectralRowCount(points, width)
+    
+    for r in range(max(2, rows - margin), min(MAXROWS + 1, rows + margin) + 1):
         
-        # Strict fit tracker variables
-        estStrictBounds = []
-        estLineGap = -1
+        evaluate(r)
+
+
+# Gets the row count between 2 and MAXROWS + 1 with the strongest frequency in the count of points per column
+def getSpectralRowCount(points, width):
+    
+    return estimateRowPeriod(getColumnProfile(points, width))[0]
+
+
+# Counts the points in each column of an image
+def getColumnProfile(points, width):
+    
+    if isinstance(points, PointIndex):
         
-        logOutput("Estimating row count for %03d.png using best fit algorithm.." % x)
+        points = points.points
     
-        for r in range(MAXROWS):
-            
-            # Number of rows for which the deviation/MSE is to be tested
-            rows = r + 2
-            
-            # Width of each strip
-            stripWidth = round(width / rows)
+    return numpy.bincount(numpy.asarray(points).reshape(-1, 2)[:, 1], minlength=width)[:width]
+
+
+# Estimates the row count, the gap between the rows and the Y coordinates of the rows from the strongest frequency of a count of points per column
+def estimateRowPeriod(profile, minRows=2, maxRows=None):
+    
+    profile = numpy.asarray(profile, dtype=numpy.float64)
+    width = len(profile)
+    
+    if maxRows is None:
+        
+        maxRows = MAXROWS + 1
+    
+    # Each frequency of the spectrum is a number of cycles over the width of the image
+    spectrum = numpy.fft.rfft(profile - profile.mean())
+    candidates = numpy.arange(minRows, min(maxRows, len(spectrum) - 1) + 1)
+    
+    if not len(candidates):
+        
+        rows = minRows
+        phase = 0
+        
+    else:
+        
+        rows = int(candidates[numpy.argmax(numpy.abs(spectrum[candidates]))])
+        phase = numpy.angle(spectrum[rows])
+    
+    lineGap = width / rows
+    
+    # The rows lie on the peaks of the cosine of the strongest frequency
+    firstLineY = (-phase / (2 * numpy.pi)) % 1 * lineGap
+    
+    return rows, lineGap, [firstLineY + (i * lineGap) for i in range(rows)]
+
+
+ROWSEARCHPOLICIES = {"linear": linearRowSearch, "golden": goldenRowSearch, "spectral": spectralRowSearch, "fft": fftRowSearch}
+
+
+# Tries the row counts chosen by a search policy with each algorithm, returning the fit of each tried row count and evaluating the candidates of all algorithms in parallel when more than one worker is requested for the linear search
+def searchRowCounts(fit, algorithms, workers=1, policy="linear", points=None, width=None, pool=None):
+    
+    results = {algorithm: {} for algorithm in algorithms}
+    
+    if workers <= 1 or policy != "linear":
+        
+        for algorithm in algorithms:
             
-            if lineFitAlg == "overlap" and continueBF:
-                
-                # Execute best fit algorithm
-                segmentsBF = []
-                totalMSEBF = 0
+            # Each row count is only fitted once however often the policy asks for it
+            def evaluate(rows, algorithm=algorithm):
                 
-                for i in range(rows):
+                if rows not in results[algorithm]:
                     
-                    subPoints = line.getSubPoints(points, (stripWidth * (i + sideTrim)), (stripWidth * (i + 1 - sideTrim)))
-                    
-                    # Get the segmentBF using the best fitting model AND the deviation/MSE
-                    segmentBF = line.getBestFit(subPoints, i * stripWidth, (i + 1) * stripWidth, height)
-                    
-                    # Append ONLY the line segmentBF to the list of line segments
-                    segmentsBF.append((segmentBF[0], segmentBF[1]))
-                    
-                    # logOutput current deviation/MSE of the line segmentBF
-                    # logOutput(segmentBF[2], " ", end='')
-                    
-                    # Update deviation/MSE
-                    totalMSEBF += segmentBF[2]
-                
-                # logOutput average deviation/MSE
-                avgMSEBF = totalMSEBF / rows
-                logOutput("MSE for %02d row(s) using best fit algorithm\t: " % rows + str(avgMSEBF))
+                    results[algorithm][rows] = fit(algorithm, rows)
                 
-                # Update minimum average deviation/MSE
-                if avgMSEBF < minMSEBF:
-                    
-                    minMSEBF = avgMSEBF
-                    estRowBF = rows
-                    
-                    estSegmentsBF = segmentsBF
-                
-                if avgMSEBF > minMSEBF:
-                    
-                    segmentsBF = estSegmentsBF
-                    
-                    continueBF = False
-                    break
+                return results[algorithm][rows][0]
+            
+            ROWSEARCHPOLICIES[policy](evaluate, points, width)
         
-        logOutput("Estimating row count for %03d.png using strict fit algorithm.." % x)
+        return results
+    
+    candidates = {algorithm: iter(range(2, MAXROWS + 2)) for algorithm in algorithms}
+    pending = {algorithm: collections.deque() for algorithm in algorithms}
+    tried = {algorithm: [] for algorithm in algorithms}
+    searching = list(algorithms)
+    
+    # Use the given pool of worker processes, or a pool of its own otherwise
+    ownPool = pool is None
+    
+    if ownPool:
         
-        for r in range(MAXROWS):
+        pool = openPool(workers)
+    
+    try:
+        
+        # Hand the fit of this image to every worker once, the barrier keeps any worker from taking two copies
+        for result in [pool.apply_async(setRowCountFit, (fit,)) for _ in range(workers)]:
             
-            # Number of rows for which the deviation/MSE is to be tested
-            rows = r + 2
+            result.get()
+        
+        while searching:
             
-            # Width of each strip
-            stripWidth = round(width / rows)
-                    
-            if lineFitAlg == "overlap" and continueSF:
-                
-                # Execute strict fit algorithm
-                
-                # strictBounds = line.getStrictFit(points, rows, height, width)
-                strictBounds = line.getStrictFit3(points, rows, width)  # MSE Minimization Variation
-                
-                lineGap = (strictBounds[1] - strictBounds[0]) / (rows - 1)
-                # logOutput("mean square error for image %03d is %f; standard deviation is %f" % (x, strictBounds[2], strictBounds[4]))
+            # Keep every worker busy with the next candidates of the algorithms still searching, taking turns between the algorithms
+            submitted = True
+            
+            while submitted and sum(len(pending[algorithm]) for algorithm in searching) < workers:
                 
-                # logOutput average deviation/MSE
-                # logOutput(strictBounds[2], strictBounds[4])
-                # logOutput("MSE for %02d row(s) using strict fit algorithm:\t: " % rows + str(strictBounds[4]) + " " + str(strictBounds[2]))
-                logOutput("MSE for %02d row(s) using strict fit algorithm:\t: " % rows + str(strictBounds[2]))
+                submitted = False
                 
-                # Update minimum average deviation/MSE
-                if strictBounds[2] < minMSESF:
+                for algorithm in searching:
                     
-                    minMSESF = strictBounds[2]
-                    estRowSF = rows
+                    rows = next(candidates[algorithm], None)
                     
-                    estStrictBounds = strictBounds
-                    estLineGap = lineGap
+                    if rows is not None:
+                        
+                        pending[algorithm].append(pool.apply_async(fitRowCountWorker, (algorithm, rows)))
+                        submitted = True
+            
+            # Collect the results of each algorithm in the order of the row counts
+            for algorithm in list(searching):
                 
-                if strictBounds[2] > minMSESF:
+                if not pending[algorithm]:
                     
-                    strictBounds = estStrictBounds
-                    lineGap = estLineGap
+                    searching.remove(algorithm)
                     
-                    continueSF = False
-                    break
+                    continue
                 
-                # logOutput out deviation for each segmentBF
-                # logOutput(*strictBounds[3])
+                tried[algorithm].append(pending[algorithm].popleft().get())
                 
-        logOutput("Estimated row(s) using best fitting algorithm\t: " + str(estRowBF))
-        logOutput("Estimated row(s) using strict fitting algorithm\t: " + str(estRowSF))
+                # Outstanding candidates past the minimum are cancelled by dropping their results
+                if isRowCountSearchDone(tried[algorithm]):
+                    
+                    pending[algorithm].clear()
+                    searching.remove(algorithm)
+    
+    finally:
         
-        if (estRowBF > estRowSF):
+        # Cancelled candidates still finish in the pool, at most one per worker, and are ignored
+        if ownPool:
             
-            logOutput("Lodging detected")
+            closePool(pool)
+    
+    for algorithm in algorithms:
+        
+        results[algorithm] = dict(enumerate(tried[algorithm], 2))
+    
+    return results
+
+
+# Estimates the row count of a filtered image with both the best fit and the strict fit algorithms, trying the candidate row counts chosen by a search policy, in parallel when more than one worker is requested
+def estimateRows(img, sideTrim, workers=1, policy=None, pool=None):
+    
+    # Image properties
+    height = len(img)
+    width = len(img[0])
+    
+    line = Line(sideTrim, PYRAMIDFACTOR, PYRAMIDWINDOW, prune=PRUNEBESTFIT)
+    points = PointIndex(line.getPoints(img))
+    
+    # Set current minimum average deviation/MSE to infinity
+    minMSEBF = minMSESF = sys.maxsize
+    
+    # Initialize row count
+    estRowBF = estRowSF = -1
+    
+    # Best fit tracker variables
+    estSegmentsBF = []
+    MSEArrBF = []
+    
+    # Strict fit tracker variables
+    estStrictBounds = []
+    estLineGap = -1
+    MSEArrSF = []
+    
+    results = searchRowCounts(functools.partial(fitRowCount, line, points, width, height), ("best", "strict"), workers, policy or ROWSEARCH, points, width, pool)
+    
+    # Number of rows for which the deviation/MSE was tested, row counts the search policy skipped have no deviation/MSE
+    for rows, (avgMSEBF, segmentsBF) in sorted(results["best"].items()):
+        
+        # Record average deviation/MSE
+        MSEArrBF.extend([None] * (rows - 2 - len(MSEArrBF)))
+        MSEArrBF.append(avgMSEBF)
+        
+        # Update minimum average deviation/MSE
+        if avgMSEBF < minMSEBF:
             
-        if (estRowBF < estRowSF):
+            minMSEBF = avgMSEBF
+            estRowBF = rows
             
-            logOutput("High lodging detected")
-                
-        # Definitions for pygame
-        if(draw):
+            estSegmentsBF = segmentsBF
+    
+    for rows, (avgMSESF, strictBounds) in sorted(results["strict"].items()):
+        
+        lineGap = (strictBounds[1] - strictBounds[0]) / (rows - 1)
+        
+        # Record average deviation/MSE
+        MSEArrSF.extend([None] * (rows - 2 - len(MSEArrSF)))
+        MSEArrSF.append(avgMSESF)
+        
+        # Update minimum average deviation/MSE
+        if avgMSESF < minMSESF:
             
-            segmentsSF = []
+            minMSESF = avgMSESF
+            estRowSF = rows
             
-            for i in range(estRowSF):
+            estStrictBounds = strictBounds
+            estLineGap = lineGap
+    
+    # Index 0 : estimated rows, index 1 : line segments and index 2 : MSE of each tested row count using best fit; index 3 : estimated rows, index 4 : bounds, index 5 : line gap and index 6 : MSE of each tested row count using strict fit; index 7 and 8 : number of fits evaluated using best fit and strict fit
+    return [estRowBF, estSegmentsBF, MSEArrBF, estRowSF, estStrictBounds, estLineGap, MSEArrSF, len(results["best"]), len(results["strict"])]
+
+
+# Runs the coarse-to-fine searches of every candidate row count of an image next to the exhaustive searches and reports how often their results differ
+def verifyPyramidSearch(img, sideTrim, pyramidFactor, pyramidWindow=None):
+    
+    # Image properties
+    height = len(img)
+    width = len(img[0])
+    
+    line = Line(sideTrim, pyramidFactor, pyramidWindow, verify=True)
+    points = PointIndex(line.getPoints(img))
+    
+    for algorithm in ("best", "strict"):
+        
+        for rows in range(2, MAXROWS + 2):
+            
+            fitRowCount(line, points, width, height, algorithm, rows)
+    
+    logOutput("Coarse-to-fine search differs from exhaustive search in %d of %d searches" % (line.mismatchCount, line.searchCount))
+    
+    return line.mismatchCount, line.searchCount
+
+
+# Logs the row count estimation of a single image
+def logRowEstimate(x, estimate):
+    
+    estRowBF, estRowSF = estimate[0], estimate[3]
+    
+    logOutput("Estimating row count for %03d.png using best fit algorithm.." % x)
+    
+    for r, avgMSEBF in enumerate(estimate[2]):
+        
+        if avgMSEBF is None:
+            
+            continue
+        
+        logOutput("MSE for %02d row(s) using best fit algorithm\t: " % (r + 2) + str(avgMSEBF))
+    
+    logOutput("Estimating row count for %03d.png using strict fit algorithm.." % x)
+    
+    for r, MSESF in enumerate(estimate[6]):
+        
+        if MSESF is None:
+            
+            continue
+        
+        logOutput("MSE for %02d row(s) using strict fit algorithm:\t: " % (r + 2) + str(MSESF))
+    
+    logOutput("Row count search evaluated %d best fit(s) and %d strict fit(s)" % (estimate[7], estimate[8]))
+    logOutput("Estimated row(s) using best fitting algorithm\t: " + str(estRowBF))
+    logOutput("Estimated row(s) using strict fitting algorithm\t: " + str(estRowSF))
+    
+    if (estRowBF > estRowSF):
+        
+        logOutput("Lodging detected")
+        
+    if (estRowBF < estRowSF):
+        
+        logOutput("High lodging detected")
+
+
+# Displays the best fit and the strict fit lines of a row count estimation on top of the filtered image
+def drawRowEstimate(fileName, estimate):
+    
+    segmentsBF = estimate[1]
+    estRowSF, strictBounds, lineGap = estimate[3], estimate[4], estimate[5]
+    
+    # Set pygame background
+    background_image = pygame.image.load(fileName)
+    width, height = background_image.get_size()
+    
+    segmentsSF = []
+    
+    for i in range(estRowSF):
+        
+        segmentsSF.append([(0, strictBounds[0] + (i * lineGap)), (height, strictBounds[0] + (i * lineGap))])
+    
+    scaleFactor = 2
+    
+    window_height = height * scaleFactor
+    window_width = width * scaleFactor
+    
+    clock_tick_rate = 20
+    
+    size = (window_width, window_height)
+    screen = pygame.display.set_mode(size)
+    
+    pygame.display.set_caption("Best Fit and Strict Fit Simulation")
+    
+    dead = False
+    
+    clock = pygame.time.Clock()
+    background_image = pygame.transform.scale(background_image.convert(), (window_width, window_height))
+    
+    while(dead == False):
+        
+        for event in pygame.event.get():
+            
+            if event.type == pygame.QUIT:
                 
-                segmentsSF.append([(0, strictBounds[0] + (i * lineGap)), (height, strictBounds[0] + (i * lineGap))])
+                dead = True
+    
+        screen.blit(background_image, [0, 0])
         
-            scaleFactor = 2
+        for segmentBF in segmentsBF:
             
-            window_height = height * scaleFactor
-            window_width = width * scaleFactor
+            pygame.draw.lines(screen, (255, 0, 0), False, [(segmentBF[0][1] * scaleFactor, segmentBF[0][0] * scaleFactor), (segmentBF[1][1] * scaleFactor, segmentBF[1][0] * scaleFactor)], scaleFactor * 2)
+        
+        for segmentSF in segmentsSF:
             
-            clock_tick_rate = 20
+            pygame.draw.lines(screen, (255, 255, 0), False, [(segmentSF[0][1] * scaleFactor, segmentSF[0][0] * scaleFactor), (segmentSF[1][1] * scaleFactor, segmentSF[1][0] * scaleFactor)], scaleFactor * 2)
+        
+        # Update and display
+        pygame.display.update()
+        pygame.display.flip()
+        clock.tick(clock_tick_rate)
+
+
+# Runs the full pipeline, handing images over between the stages in memory instead of through the image folders if requested, in which case images are only saved for debugging
+def imageProcessFull(imgName, workers=1, inMemory=False, debug=False, maskFormat=None):
+    
+    # Worker processes are started once and shared by every stage and every image
+    pool = openPool(workers) if workers > 1 else None
+    
+    try:
+        
+        runProcessFull(imgName, workers, inMemory, debug, maskFormat, pool)
+    
+    finally:
+        
+        if pool is not None:
             
-            size = (window_width, window_height)
-            screen = pygame.display.set_mode(size)
+            closePool(pool)
+
+
+# Runs the stages of the full pipeline in a pool of worker processes when one is given
+def runProcessFull(imgName, workers, inMemory, debug, maskFormat, pool):
+    
+    logOutput("Starting image processing..")
+    
+    # Initialize process handler
+    handlerProcess = File(INPUTFOLDERNAME, INTERMEDFOLDERNAME, workers)
+    
+    # determine mode of operation; batch or single
+    if (imgName == "batch"):
+        
+        # Get all images in the folder
+        imageList = handlerProcess.getImages(pool)
+        
+    else:
+        
+        # Initialize an empty image list
+        imageList = []
+        
+        # Get image
+        imageList.append(handlerProcess.getImg(imgName))
+    
+    # Process image
+    processedImageList = bulkProcess(imageList, workers, pool)
+    
+    # Save image
+    if not inMemory or debug:
+        
+        handlerProcess.setImages(processedImageList)
+    
+    logOutput("All images have been processed successfully")
+    
+    logOutput("Starting image filtering..")
+    
+    # Initialize filter handler, saving compact masks instead of greyscale images if a mask format is given
+    handlerFilter = File(INTERMEDFOLDERNAME, OUTPUTFOLDERNAME, workers, maskFormat or "png")
+    
+    # Get image
+    if inMemory:
+        
+        imageList = [toSKImg(img) for img in processedImageList]
+        
+    else:
+        
+        imageList = handlerFilter.getSKImages(pool)
+    
+    # Cluster filter image
+    filteredImageList = bulkFilter(imageList, 1, workers, pool)
+    
+    # Save image
+    if (not inMemory or debug) and maskFormat:
+        
+        handlerFilter.setMasks([toFilteredMask(img) for img in filteredImageList])
+        
+    elif not inMemory or debug:
+        
+        handlerFilter.setSKImages(filteredImageList)
+    
+    logOutput("All images have been filtered successfully")
+    
+    logOutput("Starting row count estimation..")
+    
+    # Specify row count estimation and line fitting parameters
+    sideTrim = 0.10
+    draw = False
+    
+    for x in range(len(imageList)):
+        
+        fileName = "filtered_images/%03d.png" % x
+        
+        img = None
+        
+        if inMemory:
             
-            pygame.display.set_caption("Best Fit and Strict Fit Simulation")
+            img = toFilteredMask(filteredImageList[x])
             
-            dead = False
+        elif maskFormat:
             
-            # Set pygame background
-            clock = pygame.time.Clock()
-            background_image = pygame.image.load(fileName).convert()
-            background_image = pygame.transform.scale(background_image, (window_width, window_height))
+            fileName = "filtered_images/%03d.%s" % (x, maskFormat)
             
-            while(dead == False):
+            # Open a single mask
+            try:
                 
-                for event in pygame.event.get():
-                    
-                    if event.type == pygame.QUIT:
-                        
-                        dead = True
-            
-                screen.blit(background_image, [0, 0])
+                img = readMask(fileName)
                 
-                # Check mode of operation
-                if lineFitAlg == "overlap":
+            except FileNotFoundError:
                 
-                    for segmentBF in segmentsBF:
-                        
-                        pygame.draw.lines(screen, (255, 0, 0), False, [(segmentBF[0][1] * scaleFactor, segmentBF[0][0] * scaleFactor), (segmentBF[1][1] * scaleFactor, segmentBF[1][0] * scaleFactor)], scaleFactor * 2)
-                    
-                if lineFitAlg == "overlap":
+                logOutput ("Invalid fileName")
+            
+        else:
+            
+            # Open a single image
+            try:
                 
-                    for segmentSF in segmentsSF:
-                        
-                        pygame.draw.lines(screen, (255, 255, 0), False, [(segmentSF[0][1] * scaleFactor, segmentSF[0][0] * scaleFactor), (segmentSF[1][1] * scaleFactor, segmentSF[1][0] * scaleFactor)], scaleFactor * 2)
+                img = imread(fileName)
                 
-                # Update and display
-                pygame.display.update()
-                pygame.display.flip()
-                clock.tick(clock_tick_rate)
-                        
-            # else:
+            except FileNotFoundError:
                 
-            #    continue
+                logOutput ("Invalid fileName")
+        
+        # Estimate row count
+        estimate = estimateRows(img, sideTrim, workers, pool=pool)
+        
+        logRowEstimate(x, estimate)
+        
+        # Definitions for pygame, the filtered image is only available when it has been saved
+        if(draw and (not inMemory or debug) and fileName.endswith(".png")):
             
-            # break
+            drawRowEstimate(fileName, estimate)
+    
+    logOutput("Program successfully terminated")
+
+
+# Loads, processes, filters and estimates the row count of a single raw image, saving the intermediate and the filtered image on the way unless they are handed over in memory
+def processFullImg(handlerProcess, handlerFilter, sideTrim, inMemory, debug, item):
+    
+    x, fileName = item
+    
+    # Get image
+    img = handlerProcess.getImg(fileName)
+    
+    # Process and save image
+    processedImg = processImg(img)
+    
+    if not inMemory or debug:
+        
+        handlerProcess.setImg(processedImg, x)
+    
+    # Cluster filter and save image
+    if inMemory:
+        
+        filteredImg = filterClusters(toSKImg(processedImg), 1)
+        
+    else:
+        
+        filteredImg = filterClusters(handlerFilter.getSKImg("{:03d}.png".format(x)), 1)
+    
+    if not inMemory or debug:
+        
+        handlerFilter.setSKImg(filteredImg, x)
+    
+    # Estimate row count
+    if inMemory:
+        
+        return estimateRows(toFilteredMask(filteredImg), sideTrim)
+    
+    return estimateRows(imread(handlerFilter.outF + "/{:03d}.png".format(x)), sideTrim)
+
+
+# Streams raw images one by one through processing, filtering and row count estimation, yielding the index and the estimation of each image as soon as it is done
+def iterProcessFull(imgName, workers=1, inFlight=None, sideTrim=0.10, inMemory=False, debug=False):
+    
+    # Initialize process and filter handlers
+    handlerProcess = File(INPUTFOLDERNAME, INTERMEDFOLDERNAME, workers)
+    handlerFilter = File(INTERMEDFOLDERNAME, OUTPUTFOLDERNAME, workers)
+    
+    # determine mode of operation; batch or single
+    if (imgName == "batch"):
+        
+        fileNames = handlerProcess.getFileNames()
+        
+    else:
+        
+        fileNames = [imgName]
+    
+    stages = functools.partial(processFullImg, handlerProcess, handlerFilter, sideTrim, inMemory, debug)
+    
+    for x, estimate in enumerate(imapImages(stages, enumerate(fileNames), workers, inFlight)):
+        
+        yield x, estimate
+
+
+# Streaming version of imageProcessFull that keeps at most a bounded number of images in memory
+def imageProcessStream(imgName, workers=1, inFlight=None, inMemory=False, debug=False):
+    
+    logOutput("Starting streaming image processing..")
+    
+    for x, estimate in iterProcessFull(imgName, workers, inFlight, 0.10, inMemory, debug):
+        
+        logOutput("Image {:03d}.png processing and cluster filtering completed".format(x))
+        
+        logRowEstimate(x, estimate)
     
     logOutput("Program successfully terminated")
 
@@ -1218,7 +2168,7 @@ def main():
     # Enable or disable on-screen display; DO NOT enable in batch mode
     draw = False
     
-    imageProcessFull("batch")
+    imageProcessFull("batch", WORKERS)
     
     sideTrim = 0.10
     
@@ -1256,7 +2206,7 @@ def main():
                 
                 stripWidth = round(width / rows)
                 
-                points = line.getPoints(img)
+                points = PointIndex(line.getPoints(img))
                 
                 if lineFitAlg == "best" or lineFitAlg == "overlap":
                     
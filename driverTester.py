@@ -5,7 +5,7 @@ Created on Sep 22, 2019
 '''
 
 from PIL import Image
-import unittest, driver, os
+import numpy, unittest, driver, os, MSEToCSV, segmentAndLinearRegression
 
 
 class TestDriver(unittest.TestCase):
@@ -29,6 +29,297 @@ class TestDriver(unittest.TestCase):
         
         result.close()
         os.remove("testImg.png")
+    
+    def test_adjustLevel_01(self):
+        
+        rgb = numpy.random.default_rng(0).integers(0, 256, (40, 30, 3), dtype=numpy.uint8)
+        rgb[:5] = rgb[:5, :, :1]
+        img = Image.fromarray(rgb, "RGB")
+        
+        leveller = driver.Level(100, 255, 9.99)
+        expected = [leveller.convertAndLevel(pixel) for pixel in img.getdata()]
+        
+        result = driver.adjustLevel(img, 100, 255, 9.99)
+        self.assertEqual(list(result.getdata()), expected, "Vectorized level test error")
+    
+    def test_preprocessImg_01(self):
+        
+        rgba = numpy.random.default_rng(1).integers(0, 256, (70, 50, 4), dtype=numpy.uint8)
+        img = Image.fromarray(rgba, "RGBA")
+        trimmer = driver.Trim(0.1, 1)
+        
+        levelledImg = driver.adjustLevel(driver.convertToRGB(img), 100, 255, 9.99)
+        expected = trimmer.smartTrim(driver.binarizeImg(driver.convertToGreyscale(levelledImg)))
+        
+        result = driver.preprocessImg(img, trimmer, 100, 255, 9.99, bandHeight=16)
+        self.assertEqual(result.tobytes(), expected.tobytes(), "Fused preprocessing test error")
+        self.assertEqual(result.size, expected.size, "Fused preprocessing size error")
+
+    
+    def test_getTrimBounds_01(self):
+        
+        trimmer = driver.Trim(0.5, 3)
+        
+        # Strips of three rows, only the first two strips from the top and from the bottom are compared
+        pixels = numpy.zeros((20, 4), numpy.uint8)
+        pixels[0:3] = 255
+        pixels[3, :2] = 255
+        pixels[5, 0] = 255
+        pixels[17:20, :2] = 255
+        
+        self.assertEqual(trimmer.getTrimBounds(Image.fromarray(pixels, "L")), (6, 14), "Trim bounds test error")
+        
+        # Strips at or above the threshold on both sides fall back to the middle of the image
+        pixels[:] = 255
+        self.assertEqual(trimmer.getTrimBounds(Image.fromarray(pixels, "L")), (9, 11), "Dense trim bounds test error")
+        
+        # Images shorter than two strips have no strip to compare
+        for height in (5, 10):
+            
+            img = Image.fromarray(numpy.zeros((height, 4), numpy.uint8), "L")
+            self.assertEqual(trimmer.getTrimBounds(img), (int(height / 2) - 1, int(height / 2) + 1), "Short image trim bounds test error")
+            self.assertEqual(trimmer.smartTrim(img).size, (4, 2), "Short image trim test error")
+
+    
+    def test_writeMask_01(self):
+        
+        mask = numpy.random.default_rng(2).random((37, 29)) > 0.7
+        
+        for fileName in ("testMask.npz", "testMask.png"):
+            
+            driver.writeMask(fileName, mask)
+            
+            result = driver.readMask(fileName)
+            self.assertEqual(result.dtype, bool, "Mask type test error")
+            self.assertEqual(numpy.array_equal(result, mask), True, "Mask round trip test error")
+            
+            os.remove(fileName)
+
+    
+    def test_filterClusters_01(self):
+        
+        img = numpy.zeros((600, 600), numpy.uint8)
+        img[:500, :500] = 255
+        img[550, 550] = 255
+        
+        result = driver.filterClusters(img, 1)
+        self.assertEqual(result[0, 0], 255, "Large cluster test error")
+        self.assertEqual(result[550, 550], 1, "Small cluster test error")
+        self.assertEqual(numpy.count_nonzero(result), 2, "Cluster seed test error")
+        
+        # Binary images read from disk are boolean masks
+        mask = numpy.zeros((20, 20), bool)
+        mask[2:5, 2:5] = True
+        mask[15, 15] = True
+        
+        result = driver.filterClusters(mask, 3)
+        self.assertEqual(result.dtype, numpy.uint8, "Boolean mask type test error")
+        self.assertEqual((result[2, 2], result[15, 15]), (255, 1), "Boolean mask threshold test error")
+
+    
+    def test_clusters_01(self):
+        
+        # An L-shaped cluster, a vertical bar and a single pixel
+        img = numpy.zeros((10, 12), numpy.uint8)
+        img[1:4, 1] = 255
+        img[3, 2:4] = 255
+        img[2:8, 8] = 255
+        img[9, 11] = 255
+        
+        clusters = driver.Clusters(img)
+        self.assertEqual(clusters.sizes.tolist(), [5, 6, 1], "Cluster size test error")
+        self.assertEqual(clusters.seeds.tolist(), [1 * 12 + 1, 2 * 12 + 8, 9 * 12 + 11], "Cluster seed test error")
+        self.assertEqual(numpy.allclose(clusters.centroids, [[12 / 5, 8 / 5], [4.5, 8], [9, 11]]), True, "Cluster centroid test error")
+        self.assertEqual(clusters.bboxes.tolist(), [[1, 1, 3, 3], [2, 8, 7, 8], [9, 11, 9, 11]], "Cluster bounding box test error")
+        self.assertEqual(clusters.colSpans.tolist(), [3, 1, 1], "Cluster column span test error")
+        
+        # Only the seed of each cluster is kept, white above the threshold
+        expected = numpy.zeros((10, 12), numpy.uint8)
+        expected[1, 1], expected[2, 8], expected[9, 11] = 255, 255, 1
+        self.assertEqual(numpy.array_equal(clusters.getFilteredImg(4), expected), True, "Cluster threshold test error")
+        
+        # Only the pixels of the vertical bar are above a threshold of 5
+        expected = numpy.zeros((10, 12), bool)
+        expected[2:8, 8] = True
+        self.assertEqual(numpy.array_equal(clusters.getClusterMask(5), expected), True, "Cluster mask test error")
+
+    
+    def test_getBestFit_01(self):
+        
+        line = driver.Line(0.1)
+        rng = numpy.random.default_rng(4)
+        points = [(int(y), int(x)) for y, x in zip(rng.integers(0, 30, 25), rng.integers(10, 18, 25))]
+        
+        # Exhaustive search over every pair of top and bottom pixels
+        expected = min(((sum(line.getShortestDist(point, [(0, i), (30, j)]) for point in points), i, j) for i in range(10, 18) for j in range(10, 18)), key=lambda fit: fit[0])
+        
+        result = line.getBestFit(points, 10, 18, 30)
+        self.assertEqual(result[:2], [(0, expected[1]), (30, expected[2])], "Best fit line test error")
+        self.assertAlmostEqual(result[2], pow(2, expected[0] / 26) / 10, 9, "Best fit deviation test error")
+
+    
+    def test_getStrictFit3_01(self):
+        
+        line = driver.Line(0.1)
+        
+        # Four evenly spaced vertical rows of points
+        points = [(y, x) for y in range(20) for x in (5, 15, 25, 35)]
+        
+        result = line.getStrictFit3(points, 4, 40)
+        self.assertEqual(result[:2], [5, 35], "Strict fit bounds test error")
+        self.assertEqual(result[2], 0, "Strict fit MSE test error")
+
+    
+    def test_pointIndex_01(self):
+        
+        rng = numpy.random.default_rng(5)
+        points = [(int(y), int(x)) for y, x in zip(rng.integers(0, 50, 200), rng.integers(0, 40, 200))]
+        index = driver.PointIndex(points)
+        
+        expected = sorted(point for point in points if point[1] >= 7.5 and point[1] < 21.2)
+        
+        result = index.getSubPoints(7.5, 21.2)
+        self.assertEqual(sorted(map(tuple, result.tolist())), expected, "Point index strip test error")
+        self.assertEqual(index.getStats(7.5, 21.2).tolist(), [len(expected), sum(x for y, x in expected), sum(x * x for y, x in expected)], "Point index statistics test error")
+
+    
+    def test_pyramidSearch_01(self):
+        
+        rng = numpy.random.default_rng(6)
+        points = numpy.column_stack((rng.integers(0, 60, 80), rng.integers(0, 40, 80)))
+        
+        exhaustive = driver.Line(0.1)
+        pyramid = driver.Line(0.1, 4, 40, verify=True)
+        
+        # A window as wide as the strip always contains the exhaustive optimum
+        self.assertEqual(pyramid.getBestFit(points, 0, 40, 60), exhaustive.getBestFit(points, 0, 40, 60), "Pyramid best fit test error")
+        self.assertEqual(pyramid.getStrictFit3(points, 2, 40), exhaustive.getStrictFit3(points, 2, 40), "Pyramid strict fit test error")
+        self.assertEqual((pyramid.mismatchCount, pyramid.searchCount), (0, 2), "Pyramid verification test error")
+
+    
+    def test_prunedBestFit_01(self):
+        
+        rng = numpy.random.default_rng(7)
+        points = numpy.column_stack((rng.integers(0, 80, 300), rng.integers(20, 50, 300)))
+        
+        expected = driver.Line(0.1).getBestFit(points, 20, 50, 80)
+        
+        result = driver.Line(0.1, prune=True).getBestFit(points, 20, 50, 80)
+        self.assertEqual(result, expected, "Pruned best fit test error")
+
+    
+    def test_rowSearch_01(self):
+        
+        # Eight evenly spaced vertical rows of points
+        points = numpy.array([(y, x) for y in range(0, 100, 2) for x in range(10, 160, 20)])
+        self.assertEqual(driver.getSpectralRowCount(points, 160), 8, "Spectral row count test error")
+        
+        tried = []
+        
+        # Deviation/MSE with its minimum at 6 rows
+        driver.goldenRowSearch(lambda rows: tried.append(rows) or abs(rows - 6), points, 160)
+        self.assertEqual(6 in tried, True, "Golden-section row search test error")
+
+    
+    def test_searchRowCounts_01(self):
+        
+        rng = numpy.random.default_rng(8)
+        images = []
+        
+        # Evenly spaced vertical rows of dots with some noise, four and six rows
+        for rows in (4, 6):
+            
+            img = numpy.zeros((60, 120), numpy.uint8)
+            img[::3, 10::120 // rows] = 255
+            img[rng.integers(0, 60, 30), rng.integers(0, 120, 30)] = 255
+            images.append(img)
+        
+        expected = [driver.estimateRows(img, 0.1) for img in images]
+        
+        # Both images share one pool, so the second search runs after the cancelled candidates of the first
+        pool = driver.openPool(2)
+        
+        try:
+            
+            result = [driver.estimateRows(img, 0.1, 2, pool=pool) for img in images]
+            
+        finally:
+            
+            driver.closePool(pool)
+        
+        self.assertEqual(result, expected, "Shared pool row search test error")
+        self.assertEqual(driver.estimateRows(images[0], 0.1, 2), expected[0], "Parallel row search test error")
+
+    
+    def test_estimateRowPeriod_01(self):
+        
+        # Five rows 40 pixels apart starting at column 12
+        profile = numpy.zeros(200)
+        profile[12::40] = 30
+        
+        rows, lineGap, linesY = driver.estimateRowPeriod(profile)
+        self.assertEqual((rows, lineGap), (5, 40), "Row period test error")
+        self.assertEqual(numpy.allclose(linesY, [12, 52, 92, 132, 172]), True, "Row position test error")
+
+    
+    def test_getHoughFit_01(self):
+        
+        # Three rows leaning by 20 pixels over the height of the image
+        points = [(y, x + y // 10) for y in range(200) for x in (30, 100, 170)]
+        
+        segments, votes = driver.Line(0.1).getHoughFit(points, 3, 200, 220)
+        self.assertEqual([segment[0][1] for segment in segments], [30, 100, 170], "Hough row offset test error")
+        self.assertEqual(all(abs(segment[1][1] - segment[0][1] - 20) < 2 for segment in segments), True, "Hough row angle test error")
+
+    
+    def test_findSegments_01(self):
+        
+        # Column 5 crosses three partition lines at once, the partition index moves on by one for each of its rows
+        img = numpy.zeros((3, 10), numpy.uint8)
+        img[0, 0] = img[1, 6] = 255
+        img[:, 5] = 255
+        
+        cols, segments = MSEToCSV.findSegments(img, [1.5, 4.2, 4.4, 4.6, 10])
+        self.assertEqual(cols.tolist(), [0, 5, 5, 6, 5], "Segment column test error")
+        self.assertEqual(segments.tolist(), [0, 2, 3, 4, 4], "Segment skip test error")
+
+    
+    def test_findPeaks_01(self):
+        
+        # The highest densities are at the masked borders, columns 0 to 5 and 15 to 19
+        densities = [0] * 20
+        densities[5], densities[15] = 20, 20
+        densities[9], densities[14], densities[6] = 8, 8, 7
+        
+        peaks = MSEToCSV.findPeaks(3, densities, 3)
+        self.assertEqual(peaks, [9, 14, 0], "Density peak test error")
+        self.assertEqual(densities, [0] * 20, "Density mask test error")
+
+    
+    def test_findMSE_01(self):
+        
+        # Every dot is one column away from the line of its partition
+        img = numpy.zeros((2, 10), numpy.uint8)
+        img[0, 1] = img[1, 3] = img[0, 6] = img[1, 8] = 255
+        
+        result = MSEToCSV.findMSE(img, [7, 2], 2)
+        self.assertEqual(result, [1.0, 1, [0.0, 0.0], [1, 1]], "Density MSE test error")
+
+
+    
+    def test_segmentedRegression_01(self):
+        
+        # Three segments of three columns: two dots on one row, no dots, and a leaning row with a dot on the right border
+        coordinates = numpy.array([(5, 0), (5, 2), (0, 6), (2, 7), (4, 8), (6, 9)])
+        
+        index = segmentAndLinearRegression.segment_index(3, coordinates, 9)
+        self.assertEqual(index.tolist(), [0, 0, 2, 2, 2, 2], "Segment index test error")
+        
+        slope, intercept, mse = segmentAndLinearRegression.segmented_regression(3, coordinates, 9)
+        self.assertEqual((slope[0], intercept[0], mse[0]), (0, 1, 1), "Single row segment test error")
+        self.assertEqual(numpy.isnan([slope[1], intercept[1], mse[1]]).all(), True, "Empty segment test error")
+        self.assertEqual(numpy.allclose([slope[2], intercept[2], mse[2]], [0.5, 6, 0]), True, "Segment regression test error")
+
 
 
 if __name__ == "__main__":
@@ -6,6 +6,7 @@ Created on Oct 1, 2019
 '''
 import numpy as np
 from skimage.io import imread
+from skimage.measure import label
 import matplotlib.pyplot as plt
 from PIL import Image
 
@@ -42,38 +43,29 @@ def findSegmentBoarders(image,label): #find the right boarder for the first labe
     arr.append(col)
     return arr
 
-def dfs2(i,j,row,col,image,centerPoint,closedPoint,minDist):#closedPoint is an array to store the most closed point with x,y coordinates 
-    if(i<0 or i>=row or j<0 or j>=col):#minDist is to store the minimum distance from all points in cluster
-        return
-    if(image[i][j]==0 or image[i][j]==1): return
-    if(image[i][j]==255):
-        image[i][j]=0
-        distY = abs(j-centerPoint) 
-        if(distY<minDist):           
-            closedPoint[0]=i
-            closedPoint[1]=j
-            #print(closedPoint)
-            minDist = distY  
-    #print(closedPoint)
-    dfs2(i+1,j,row,col,image,centerPoint,closedPoint,minDist)
-    dfs2(i,j+1,row,col,image,centerPoint,closedPoint,minDist)
-    dfs2(i-1,j,row,col,image,centerPoint,closedPoint,minDist)
-    dfs2(i,j-1,row,col,image,centerPoint,closedPoint,minDist)
-    return closedPoint   
-
-def reduceCluster2(image,boarders):# pick the points most closed to the center
-    row = len(image)
-    col = len(image[0]) 
-    n = len(boarders)
-    for i in range(row):
-        for j in range(col):
-            for k in range(n-1):
-                if(j>boarders[k] and j<boarders[k+1]):
-                    centerPoint = (boarders[k+1]+boarders[k])/2
-                    closedPoint = [i,j]
-                    closedPoint = dfs2(i,j,row,col,image,centerPoint,closedPoint,col)#tried to pass closedPoint by reference, but it didn't work like that.So add return the closedpoint in dfs instead.
-                    if(closedPoint is not None):
-                        image[closedPoint[0]][closedPoint[1]]=1
+def reduceCluster2(image,boarders):# pick the points most closed to the center, one per cluster, using cluster labels instead of a dfs from every pixel
+    labels = label(image==255,connectivity=1)
+    flatLabels = labels.ravel()
+    white = np.flatnonzero(flatLabels) #white pixels in raster order
+    if(len(white)==0): return
+    rows,cols = np.divmod(white,image.shape[1])
+    clusters = flatLabels[white]
+    boarders = np.asarray(boarders,dtype=float)
+    k = np.searchsorted(boarders,cols,side='left')-1 #boarders[k] < j <= boarders[k+1]
+    inside = (k>=0)&(k<len(boarders)-1)
+    inside[inside] = cols[inside]<boarders[k[inside]+1] #only points strictly inside a segment start a cluster
+    centerPoints = np.full(flatLabels.max()+1,np.nan)
+    firstInside = np.unique(clusters[inside],return_index=True)
+    centerPoints[firstInside[0]] = (boarders[k[inside][firstInside[1]]]+boarders[k[inside][firstInside[1]]+1])/2 #the segment of a cluster is the one of its first point strictly inside a segment
+    keep = ~np.isnan(centerPoints[clusters]) #clusters never inside a segment are left untouched
+    rows,cols,clusters = rows[keep],cols[keep],clusters[keep]
+    distY = np.abs(cols-centerPoints[clusters])
+    order = np.lexsort((np.arange(len(clusters)),distY,clusters)) #closest point first, ties broken in raster order
+    first = np.ones(len(order),dtype=bool)
+    first[1:] = clusters[order][1:]!=clusters[order][:-1]
+    closedPoints = order[first]
+    image[rows,cols] = 0
+    image[rows[closedPoints],cols[closedPoints]] = 1
     
 
 def showPic(image):
@@ -81,10 +73,7 @@ def showPic(image):
     img.show()  
     
 def changeto225(image):
-    for i in range(len(image)):
-        for j in range(len(image[0])):
-            if(image[i][j]==1):
-                image[i][j]=255
+    image[image==1]=255
     
 def main3():
     FileName = "040.png"
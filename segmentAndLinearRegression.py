@@ -14,38 +14,59 @@ import numpy as np
 from skimage.io import imread
 import matplotlib.pyplot as plt
 from PIL import Image
-import math
-from sklearn.linear_model import LinearRegression
 import driver as dr
 
 
 # convert the image to coordinates array
 def toNpArray(image):
-    arr = []
-    for i in range(len(image)):
-        for j in range(len(image[0])):
-            if image[i][j] == 255:  # if there is a dot, save its coordinates               
-                arr.append((i, j))
-    return arr;
+    return dr.getPoints(image)  # (N, 2) array of the coordinates of the dots
 
 
-# equally segment the coordinates, return 2d array
-def segment(label, coordinates, width, col):
-    array2d = [[] for i in range(label)]  # segment points
-    for coor in coordinates:
-        index = math.floor(coor[1] / width)
-        array2d[index].append(coor);
-    return array2d
+# segment index of every coordinate, one integer division for all of them (x * label // col == floor(x / (col / label)))
+def segment_index(label, coordinates, col):
+    return np.minimum(np.asarray(coordinates)[:, 1].astype(np.int64) * label // int(col), label - 1)
+
+
+# equally segment the coordinates, return list of (n, 2) arrays
+def segment(label, coordinates, col):
+    coordinates = np.asarray(coordinates)
+    index = segment_index(label, coordinates, col)
+    order = np.argsort(index, kind='stable')  # keep the points of each segment in their original order
+    return np.split(coordinates[order], np.cumsum(np.bincount(index, minlength=label))[:-1])
+
+
+# linear regression(y to x) of every segment at once from the grouped sums of y, x, xy, y^2 (and x^2 for the MSE)
+# return arrays of slope, intercept and MSE per segment, nan for a segment without points
+def fit_segments(index, coordinates, label):
+    coordinates = np.asarray(coordinates)
+    y = coordinates[:, 0].astype(np.float64)
+    x = coordinates[:, 1].astype(np.float64)
+    n = np.bincount(index, minlength=label).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sy = np.bincount(index, y, label)
+        sx = np.bincount(index, x, label)
+        syy = np.bincount(index, y * y, label) - sy * sy / n  # centered sums
+        sxy = np.bincount(index, x * y, label) - sx * sy / n
+        sxx = np.bincount(index, x * x, label) - sx * sx / n
+        slope = np.where(syy > 0, sxy / syy, 0.0)  # all points on one y: vertical line through the mean x, like sklearn
+        slope[n == 0] = np.nan
+        intercept = (sx - slope * sy) / n
+        mse = np.maximum(sxx - slope * sxy, 0.0) / n
+    return (slope, intercept, mse)
+
+
+# segment the coordinates into label equal columns and fit every segment at once
+def segmented_regression(label, coordinates, col):
+    return fit_segments(segment_index(label, coordinates, col), coordinates, label)
 
 
 # do linear_regression(y to x) by the given data([x1,y1],[x2,y2]...)
 # return a pair of predicted x, and actural Y for graph
 def linear_regression(arr):
     np_coor = np.array(arr)
-    x = np_coor[:, 1].reshape(-1, 1)
     Y = np_coor[:, 0].reshape(-1, 1)
-    reg = LinearRegression().fit(Y, x)  # Since it is vertical line, fit y to x(reverse x and y in normal regression)
-    x_pred = reg.predict(Y);
+    slope, intercept, mse = fit_segments(np.zeros(len(np_coor), np.int64), np_coor, 1)  # Since it is vertical line, fit y to x(reverse x and y in normal regression)
+    x_pred = slope[0] * Y + intercept[0];
     return (x_pred, Y)
 
 
@@ -64,20 +85,18 @@ def main2():
     # np array
     # row1 = len(img1)
     col1 = len(img1[0])
-    width1 = col1 / label1
     filteredImage1 = dr.filterClusters(img1, 10)
     coordinates1 = toNpArray(filteredImage1)
-    arr1 = segment(label1, coordinates1, width1, col1);
+    arr1 = segment(label1, coordinates1, col1);
     plt.figure(1);
     drawImg(coordinates1, arr1)
     
     img2 = imread("000.png")  # Looks like lodged. I took it from cybox
     label2 = 4;  # "000.png" has four rows of corns
     col2 = len(img2[0])
-    width2 = col2 / label2
     filteredImage2 = dr.filterClusters(img2, 10)
     coordinates2 = toNpArray(filteredImage2)
-    arr2 = segment(label2, coordinates2, width2, col2);
+    arr2 = segment(label2, coordinates2, col2);
     plt.figure(2)
     drawImg(coordinates2, arr2)
     